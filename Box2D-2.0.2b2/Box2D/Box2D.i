@@ -1643,3 +1643,8 @@
 
 %include "Box2D/Box2D.h"
 
+/* ---- buffered contact listener ---- */
+/* after Box2D.h: SWIG has to know b2ContactListener, b2ContactPoint and
+   the int32/uint16/float32 typedefs, or it drops the base class */
+%feature("nodirector") b2BufferedContactListener;
+%include "Box2D/Box2D_contactbuffer.i"
@@ -0,0 +1,153 @@
+/* Note: A b2ContactListener director calls into Python for every contact point
+   that is added, persists or is removed, and a resting pile of bodies produces
+   Persist calls on every step. b2BufferedContactListener filters the contact
+   points in C++ and keeps the ones that pass in a buffer, which Python reads
+   with a single Flush() call after b2World::Step.
+
+   A contact point is kept if any of the rules matches it. A rule matches if
+   the type of the point is in its typeMask (bit 0 - add, 1 - persist,
+   2 - remove), the category bits of the shapes intersect categoryBits1 and
+   categoryBits2 (in either order) and the length of the relative velocity is
+   at least minVelocity. Points matching several rules are kept once.
+
+   Flush() returns a tuple of (type, userData1, userData2, x, y, velocity)
+   tuples, where the user data are those of the bodies of the shapes, and
+   empties the buffer.
+ */
+
+%{
+    #include <vector>
+%}
+
+%feature("docstring") b2BufferedContactListener "
+    Contact listener that buffers the contact points matching its rules.
+
+    AddRule(typeMask, categoryBits1, categoryBits2, minVelocity)
+    Flush() -> ((type, userData1, userData2, x, y, velocity), ...)
+";
+
+%inline %{
+    class b2BufferedContactListener : public b2ContactListener {
+    public:
+        b2BufferedContactListener() { }
+
+        ~b2BufferedContactListener() {
+            Clear();
+        }
+
+        void AddRule(int32 typeMask, uint16 categoryBits1, uint16 categoryBits2, float32 minVelocity) {
+            b2BufferedContactRule rule;
+            rule.typeMask = typeMask;
+            rule.categoryBits1 = categoryBits1;
+            rule.categoryBits2 = categoryBits2;
+            rule.minVelocitySquared = minVelocity * minVelocity;
+            m_rules.push_back(rule);
+        }
+
+        void ClearRules() {
+            m_rules.clear();
+        }
+
+        int32 GetCount() const {
+            return (int32)m_events.size();
+        }
+
+        // drops the buffered contact points
+        void Clear() {
+            for (size_t i=0; i < m_events.size(); i++) {
+                Py_XDECREF(m_events[i].userData1);
+                Py_XDECREF(m_events[i].userData2);
+            }
+            m_events.clear();
+        }
+
+        PyObject* Flush() {
+            PyObject* ret=PyTuple_New(m_events.size());
+            if (!ret)
+                return NULL;
+
+            for (size_t i=0; i < m_events.size(); i++) {
+                const b2BufferedContactEvent& e = m_events[i];
+                PyObject* event=PyTuple_New(6);
+                PyTuple_SetItem(event, 0, PyInt_FromLong(e.type));
+                // the buffer's references are passed to the tuple
+                PyTuple_SetItem(event, 1, e.userData1);
+                PyTuple_SetItem(event, 2, e.userData2);
+                PyTuple_SetItem(event, 3, PyFloat_FromDouble(e.x));
+                PyTuple_SetItem(event, 4, PyFloat_FromDouble(e.y));
+                PyTuple_SetItem(event, 5, PyFloat_FromDouble(e.velocity));
+                PyTuple_SetItem(ret, i, event);
+            }
+            m_events.clear();
+            return ret;
+        }
+
+        void Add(const b2ContactPoint* point) {
+            Record(0, point);
+        }
+
+        void Persist(const b2ContactPoint* point) {
+            Record(1, point);
+        }
+
+        void Remove(const b2ContactPoint* point) {
+            Record(2, point);
+        }
+
+    private:
+        struct b2BufferedContactRule {
+            int32 typeMask;
+            uint16 categoryBits1;
+            uint16 categoryBits2;
+            float32 minVelocitySquared;
+        };
+
+        struct b2BufferedContactEvent {
+            int32 type;
+            PyObject* userData1;
+            PyObject* userData2;
+            float32 x, y;
+            float32 velocity;
+        };
+
+        std::vector<b2BufferedContactRule> m_rules;
+        std::vector<b2BufferedContactEvent> m_events;
+
+        bool Matches(int32 type, const b2ContactPoint* point) const {
+            uint16 c1 = point->shape1->GetFilterData().categoryBits;
+            uint16 c2 = point->shape2->GetFilterData().categoryBits;
+            float32 v2 = point->velocity.LengthSquared();
+
+            for (size_t i=0; i < m_rules.size(); i++) {
+                const b2BufferedContactRule& r = m_rules[i];
+                if (!(r.typeMask & (1 << type)) || v2 < r.minVelocitySquared)
+                    continue;
+                if (((c1 & r.categoryBits1) && (c2 & r.categoryBits2)) ||
+                    ((c1 & r.categoryBits2) && (c2 & r.categoryBits1)))
+                    return true;
+            }
+            return false;
+        }
+
+        static PyObject* BodyUserData(b2Shape* shape) {
+            PyObject* ret=(PyObject*)shape->GetBody()->GetUserData();
+            if (!ret) ret=Py_None;
+            Py_INCREF(ret);
+            return ret;
+        }
+
+        void Record(int32 type, const b2ContactPoint* point) {
+            if (!Matches(type, point))
+                return;
+
+            b2BufferedContactEvent e;
+            e.type = type;
+            e.userData1 = BodyUserData(point->shape1);
+            e.userData2 = BodyUserData(point->shape2);
+            e.x = point->position.x;
+            e.y = point->position.y;
+            e.velocity = point->velocity.Length();
+            m_events.push_back(e);
+        }
+    };
+%}
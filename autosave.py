@@ -0,0 +1,91 @@
+import os
+import threading
+import levelfile
+
+# atomically replaces 'filename' with 'data' (a reader sees either the old
+# or the new file, never a partially written one)
+def writeAtomically(filename, data):
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        os.rename(tmp, filename)
+    except OSError:
+        # rename doesn't replace an existing file on Windows
+        os.remove(filename)
+        os.rename(tmp, filename)
+
+
+# Saves levels on a worker thread.
+# 'save' only captures the records of the actors (see levelfile.actorRecords),
+# encoding, compressing and writing happen on the worker. Saves waiting for
+# the worker are coalesced: a newer save of a file replaces the waiting one,
+# and at most 'capacity' files wait at once (the oldest one is dropped when
+# another file is saved).
+class LevelSaver:
+    def __init__(self, capacity = 4, compress = True):
+        self.capacity = capacity
+        self.compress = compress
+        self.pending = [] # [(filename, records)], oldest first
+        self.condition = threading.Condition()
+        self.closed = False
+        self.busy = False
+        self.saved = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.lastError = None
+        self.thread = threading.Thread(target = self.run_,
+                name = 'LevelSaver')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def save(self, filename, actors):
+        records = levelfile.actorRecords(actors)
+        with self.condition:
+            for i, (name, r) in enumerate(self.pending):
+                if name == filename:
+                    del self.pending[i]
+                    self.coalesced += 1
+                    break
+            else:
+                if len(self.pending) >= self.capacity:
+                    del self.pending[0]
+                    self.dropped += 1
+            self.pending.append((filename, records))
+            self.condition.notify()
+
+    def run_(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending: return
+                filename, records = self.pending.pop(0)
+                self.busy = True
+
+            try:
+                writeAtomically(filename,
+                        levelfile.encode(records, self.compress))
+                self.saved += 1
+            except Exception, e:
+                print 'Saving %s failed: %s' % (filename, e)
+                self.lastError = e
+
+            with self.condition:
+                self.busy = False
+                self.condition.notifyAll()
+
+    # waits until every pending save is written
+    def flush(self):
+        with self.condition:
+            while self.pending or self.busy:
+                self.condition.wait()
+
+    # writes the pending saves and stops the worker
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notifyAll()
+        self.thread.join()
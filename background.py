@@ -0,0 +1,90 @@
+import math
+import pygame
+import utils
+from sprite_cache import surfacePixels
+
+# The background is a grid of cogwheels covering the whole level.
+# When the view is settled (the zoom and the world angle were the same during
+# the previous frame) the grid is rendered once into an off-screen layer for
+# that (zoom, angle) and only the visible part of the layer is blitted.
+# While the view is animating only the tiles that intersect the screen are
+# drawn.
+class BackgroundLayer:
+    spr_name = './sprites/cogwheel.png'
+    tile = (30, 30)
+
+    def __init__(self, graphics, settings):
+        self.graphics = graphics
+        self.settings = settings
+        self.layers = utils.LRUCache(
+                settings.background_cache_pixels,
+                lambda (layer, origin): surfacePixels(layer))
+        self.lastKey = None
+
+    def viewKey(self):
+        camera = self.graphics.camera
+        return (round(camera.scale, 3), round(camera.angle, 3))
+
+    # world positions of the tiles whose sprites intersect the given rectangle
+    def tiles(self, (x0, y0, x1, y1)):
+        W,H = self.graphics.level.size
+        w,h = self.tile
+        def indices(lo, hi, size, limit):
+            first = max(0, int(math.floor((lo - size) / (2.*size))))
+            last = min((limit - 1) // (2*size), int(math.floor(hi / (2.*size))))
+            return xrange(first, last + 1)
+
+        for i in indices(x0, x1, w, W):
+            for j in indices(y0, y1, h, H):
+                yield (2*w*i + w/2, 2*h*j + h/2)
+
+    def halfSize(self):
+        w,h = self.tile
+        return (w/2, h/2)
+
+    # renders every tile of the level into a new surface; returns the surface
+    # and the position of the world origin on it
+    def render(self):
+        g = self.graphics
+        W,H = g.level.size
+        camera = g.camera
+        ox,oy = camera.toScreen(0, 0)
+        corners = camera.toScreenMany(((W,0), (0,H), (W,H)))
+        xs = [0] + [x-ox for x,y in corners]
+        ys = [0] + [y-oy for x,y in corners]
+
+        margin = camera.scaleLength(max(self.tile))
+        w = max(xs) - min(xs) + 2*margin
+        h = max(ys) - min(ys) + 2*margin
+        if w*h > self.settings.background_cache_pixels:
+            return None
+
+        layer = pygame.Surface((w, h)).convert()
+        layer.fill((0,0,0))
+        origin = (margin - min(xs), margin - min(ys))
+        for x,y in camera.toScreenMany(self.tiles((0, 0, W, H))):
+            g.blitSprite(layer,
+                    (x - ox + origin[0], y - oy + origin[1]),
+                    self.spr_name, self.halfSize())
+        return (layer, origin)
+
+    def paint(self, screen):
+        key = self.viewKey()
+        settled = key == self.lastKey
+        self.lastKey = key
+
+        entry = self.layers.get(key)
+        if entry is None and settled:
+            entry = self.render()
+            if entry: self.layers.put(key, entry)
+
+        if entry is None:
+            for pos in self.tiles(self.graphics.camera.worldBounds()):
+                self.graphics.putSprite(pos, self.spr_name, self.halfSize())
+            return
+
+        layer, (lx, ly) = entry
+        ox,oy = self.graphics.camera.toScreen(0, 0)
+        dx,dy = ox - lx, oy - ly
+        area = pygame.Rect((-dx, -dy), screen.get_size()).clip(layer.get_rect())
+        screen.blit(layer, (dx + area.x, dy + area.y), area)
@@ -0,0 +1,288 @@
+"""
+Runs many headless levels in parallel, e.g. a regression run of a level
+pack:
+
+    python batch.py jobs.jsonl -o results.jsonl -j 8
+
+Every line of the jobs file is a JSON object:
+
+    {"id": "pack1-03", "level": "pack1/03.tog", "script": "pack1/03.txt",
+     "seed": 7, "set": {"time": 30}, "steps": 2000, "timeout": 60}
+
+Only "level" is required. "input" (a recorded input log) or "script" (an
+input script, see replay.parseScript) feed the level, "set" overrides
+settings, "steps" is the step budget and "timeout" the wall time limit in
+seconds (Settings.batch_timeout by default). The id defaults to the line
+number.
+
+A result is written as a JSON line as soon as its job is done, so results
+come in the order the jobs finish. Next to what headless.py reports it has
+the id and a status:
+
+    ok       - the level ran until its time was up
+    budget   - the step budget ran out first
+    diverged - a body ended up at NaN or infinity
+    timeout  - the job ran out of wall time
+    killed   - the worker hung and was killed
+    crashed  - the worker died while running the job
+    error    - the job failed, see "error"
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import multiprocessing
+from multiprocessing.queues import SimpleQueue
+from collections import deque
+import settings
+import session
+import headless
+from levels import PickledLevel
+
+class JobTimeout(Exception): pass
+
+# extra wall time a worker gets to report a timeout before it's killed
+KILL_GRACE = 5.
+
+def jobTimeout(job):
+    if 'timeout' in job: return job['timeout']
+    overrides = job.get('set') or {}
+    return overrides.get('batch_timeout', settings.Settings.batch_timeout)
+
+def readJobs(f):
+    for lineNo, line in enumerate(f, 1):
+        line = line.strip()
+        if not line or line.startswith('#'): continue
+        job = json.loads(line)
+        job.setdefault('id', lineNo)
+        yield job
+
+
+# A headless runner that checks the level for NaN positions every
+# 'checkSteps' steps and stops when it finds one, or when the job runs out
+# of time.
+class BatchRunner(headless.HeadlessRunner):
+    def __init__(self, sess, inputLog = None, maxSteps = None,
+            checkSteps = 60):
+        headless.HeadlessRunner.__init__(self, sess, inputLog, maxSteps)
+        self.checkSteps = max(1, checkSteps)
+        self.status = None
+
+    def step(self):
+        headless.HeadlessRunner.step(self)
+        if self.level.steps % self.checkSteps == 0 and self.level.diverged():
+            self.status = 'diverged'
+
+    def done(self):
+        return self.status is not None or \
+                headless.HeadlessRunner.done(self)
+
+    def run(self):
+        started = time.time()
+        try:
+            res = headless.HeadlessRunner.run(self)
+        except JobTimeout:
+            self.status = 'timeout'
+            res = self.result(time.time() - started)
+
+        if self.status is None:
+            if self.level.diverged(): self.status = 'diverged'
+            elif self.level.timeLeft() > 0: self.status = 'budget'
+            else: self.status = 'ok'
+        res['status'] = self.status
+        return res
+
+
+# worker side
+
+def onAlarm_(signum, frame):
+    raise JobTimeout()
+
+# (job index, worker pid) of the jobs started, see BatchExecutor
+started_ = None
+
+def initWorker_(started):
+    global started_
+    started_ = started
+    # the parent handles ^C and terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGALRM, onAlarm_)
+
+def runTracked_(index, job):
+    started_.put((index, os.getpid()))
+    return runJob(job)
+
+def runJob(job):
+    res = {'id': job['id'], 'level': job.get('level')}
+    timeout = jobTimeout(job)
+    sess = None
+    try:
+        st = headless.makeSettings(job.get('set'))
+        inputLog = headless.loadInput(job.get('input'), job.get('script'))
+        seed = job.get('seed')
+        if seed is None and inputLog is not None:
+            seed = inputLog.seed
+        sess = session.Session(st, seed)
+        sess.level = PickledLevel(job['level'], sess)
+        runner = BatchRunner(sess, inputLog, job.get('steps'),
+                st.batch_check_steps)
+
+        if timeout: signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            res.update(runner.run())
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    except JobTimeout:
+        # fired before the runner started
+        res['status'] = 'timeout'
+    except Exception, e:
+        res['status'] = 'error'
+        res['error'] = '%s: %s' % (type(e).__name__, e)
+    finally:
+        # the workers run many jobs, nothing of this one may stay behind
+        if sess is not None and sess.level is not None:
+            sess.level.destroy()
+    return res
+
+
+# parent side
+
+def isAlive_(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+def failed_(job, status):
+    return {'id': job['id'], 'level': job.get('level'), 'status': status}
+
+class RunningJob_:
+    def __init__(self, job, result, deadline):
+        self.job = job
+        self.result = result # AsyncResult
+        self.deadline = deadline
+        self.pid = None # of the worker, once it started the job
+
+
+# Runs jobs on a pool of 'processes' worker processes. The workers live as
+# long as the pool, so Box2D and the game modules are imported once per
+# worker, not once per job.
+#
+# Every worker reports the jobs it starts. A job whose worker died gets
+# the 'crashed' status (the pool replaces the worker). A worker that doesn't
+# report back within its job's timeout (plus KILL_GRACE, counted from when
+# it started the job) is stuck outside of Python: the pool is then
+# terminated and started again, and the jobs that were running on it are
+# run again. Jobs without a timeout are only checked for crashes.
+class BatchExecutor:
+    def __init__(self, processes = None):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.pool = None
+        self.started = None
+        self.restarts = 0
+
+    def startPool_(self):
+        # a new queue, so that nothing reported by the old workers is read
+        self.started = SimpleQueue()
+        self.pool = multiprocessing.Pool(self.processes, initWorker_,
+                (self.started,))
+
+    def stopPool_(self):
+        self.pool.terminate()
+        self.pool.join()
+        self.pool = None
+
+    def trackStarts_(self, running):
+        while not self.started.empty():
+            index, pid = self.started.get()
+            r = running.get(index)
+            if r is None: continue
+            r.pid = pid
+            timeout = jobTimeout(r.job)
+            if timeout: r.deadline = time.time() + timeout + KILL_GRACE
+
+    # yields the results of 'jobs' in the order they finish
+    def run(self, jobs):
+        pending = deque(enumerate(jobs))
+        running = {} # job index -> RunningJob_
+        self.startPool_()
+        try:
+            while pending or running:
+                while pending and len(running) < self.processes:
+                    index, job = pending.popleft()
+                    # until the worker reports the start of the job
+                    timeout = jobTimeout(job)
+                    deadline = None
+                    if timeout: deadline = time.time() + timeout + KILL_GRACE
+                    running[index] = RunningJob_(job, self.pool.apply_async(
+                            runTracked_, (index, job)), deadline)
+                self.trackStarts_(running)
+
+                finished = [i for i, r in running.items() if r.result.ready()]
+                for i in finished:
+                    yield running.pop(i).result.get()
+                if finished: continue
+
+                crashed = [i for i, r in running.items()
+                        if r.pid is not None and not isAlive_(r.pid)]
+                for i in crashed:
+                    r = running.pop(i)
+                    # it may have finished right before its worker died
+                    if r.result.ready(): yield r.result.get()
+                    else: yield failed_(r.job, 'crashed')
+                if crashed: continue
+
+                now = time.time()
+                hung = set(i for i, r in running.items()
+                        if r.deadline is not None and now > r.deadline)
+                if hung:
+                    self.stopPool_()
+                    self.restarts += 1
+                    again = []
+                    # results that came in before the pool was terminated
+                    # are kept, hung jobs included
+                    for i, r in sorted(running.items()):
+                        if r.result.ready(): yield r.result.get()
+                        elif i in hung: yield failed_(r.job, 'killed')
+                        else: again.append((i, r.job))
+                    running.clear()
+                    pending.extendleft(reversed(again))
+                    self.startPool_()
+                    continue
+
+                time.sleep(0.01)
+        finally:
+            if self.pool is not None:
+                self.stopPool_()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description = 'Runs headless levels in parallel.')
+    parser.add_argument('jobs', help = 'JSON lines file of jobs, - for stdin')
+    parser.add_argument('-o', '--output', help = 'results file (stdout)')
+    parser.add_argument('-j', '--processes', type = int,
+            help = 'worker processes (one per CPU)')
+    args = parser.parse_args()
+
+    if args.jobs == '-': jobs = list(readJobs(sys.stdin))
+    else:
+        with open(args.jobs) as f:
+            jobs = list(readJobs(f))
+    out = open(args.output, 'w') if args.output else sys.stdout
+
+    executor = BatchExecutor(args.processes)
+    statuses = {}
+    started = time.time()
+    for res in executor.run(jobs):
+        out.write(json.dumps(res, sort_keys = True) + '\n')
+        out.flush()
+        statuses[res['status']] = statuses.get(res['status'], 0) + 1
+    if out is not sys.stdout: out.close()
+
+    sys.stderr.write('%d jobs in %.1f s: %s\n' % (len(jobs),
+            time.time() - started,
+            ', '.join('%d %s' % (statuses[s], s) for s in sorted(statuses))))
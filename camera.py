@@ -0,0 +1,87 @@
+import math
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# A snapshot of the view taken once per frame (see Graphics.updateCamera).
+# The camera position, world angle and scale are read when the snapshot is
+# taken, so converting a point is plain float arithmetic.
+# Batch variants accept a sequence of (x, y) pairs or, if NumPy is
+# available, an N x 2 array (and then return an array as well).
+class Camera:
+    def __init__(self, settings):
+        self.screen_size = settings.screen_size
+        self.update((0., 0.), 0., 1.)
+
+    def update(self, position, angle, scale):
+        self.x, self.y = float(position[0]), float(position[1])
+        self.angle = angle
+        self.scale = scale
+        self.cos = math.cos(angle)
+        self.sin = math.sin(angle)
+
+        sw,sh = self.screen_size
+        self.half_w = sw/2
+        self.half_h = sh - sh/2
+
+    # world coordinates -> screen coordinates
+    def toScreen(self, x, y):
+        dx, dy = x - self.x, y - self.y
+        c, s, k = self.cos, self.sin, self.scale
+        return (int((c*dx + s*dy) * k) + self.half_w,
+                self.half_h - int((c*dy - s*dx) * k))
+
+    # screen coordinates -> world coordinates
+    def toWorld(self, x, y):
+        k = 1. / self.scale
+        x = (x - self.half_w) * k
+        y = (self.half_h - y) * k
+        c, s = self.cos, self.sin
+        return (c*x - s*y + self.x, s*x + c*y + self.y)
+
+    def scaleLength(self, length):
+        return int(length * self.scale)
+
+    def toScreenMany(self, points):
+        if numpy is not None and isinstance(points, numpy.ndarray):
+            dx = points[:,0] - self.x
+            dy = points[:,1] - self.y
+            sx = ((self.cos*dx + self.sin*dy) * self.scale).astype(int)
+            sy = ((self.cos*dy - self.sin*dx) * self.scale).astype(int)
+            return numpy.column_stack((sx + self.half_w, self.half_h - sy))
+
+        x0, y0 = self.x, self.y
+        c, s, k = self.cos, self.sin, self.scale
+        hw, hh = self.half_w, self.half_h
+        return [(int((c*(x-x0) + s*(y-y0)) * k) + hw,
+                 hh - int((c*(y-y0) - s*(x-x0)) * k)) for x,y in points]
+
+    def toWorldMany(self, points):
+        k = 1. / self.scale
+        c, s = self.cos, self.sin
+        if numpy is not None and isinstance(points, numpy.ndarray):
+            x = (points[:,0] - self.half_w) * k
+            y = (self.half_h - points[:,1]) * k
+            return numpy.column_stack(
+                    (c*x - s*y + self.x, s*x + c*y + self.y))
+
+        return [self.toWorld(x, y) for x,y in points]
+
+    # the world-aligned rectangle (x0, y0, x1, y1) containing the rotated
+    # screen, extended by 'margin' world units
+    def worldBounds(self, margin = 0.):
+        sw,sh = self.screen_size
+        corners = self.toWorldMany(((0,0), (sw,0), (0,sh), (sw,sh)))
+        xs = [x for x,y in corners]
+        ys = [y for x,y in corners]
+        return (min(xs) - margin, min(ys) - margin,
+                max(xs) + margin, max(ys) + margin)
+
+    # body-local points (e.g. polygon vertices) of a body placed at
+    # 'position' and rotated by 'angle' -> screen coordinates
+    def toScreenLocal(self, points, position, angle):
+        px, py = position[0], position[1]
+        c, s = math.cos(angle), math.sin(angle)
+        return self.toScreenMany(
+                [(px + c*x - s*y, py + s*x + c*y) for x,y in points])
@@ -1,7 +1,11 @@
-import pygame
-from pygame.locals import *
 import utils
-import graphics
+import itertools
+from collections import OrderedDict
+try:
+    import pygame
+    from pygame.locals import *
+except ImportError:
+    pygame = None # headless, events come from replay.InputReplay
 
 # controller events
 CTRL = utils.Enum(
@@ -27,59 +31,80 @@ CTRL = utils.Enum(
 
         'DUMP',
         'LOAD',
+        'TIMINGS',
 
         # mouse
         'LEFT_BUTTON',
         'MIDDLE_BUTTON',
         'RIGHT_BUTTON',
         'MOUSE_MOTION',
+
+        # keyboard, added after the mouse codes to keep the codes of the
+        # recorded input logs (see replay.py)
+        'RETRY',
+        'REWIND',
         )
 
 
-PYGAME_KB_MAP = {
-        K_LEFT:     CTRL.ARROW_LEFT,
-        K_DOWN:     CTRL.ARROW_DOWN,
-        K_RIGHT:    CTRL.ARROW_RIGHT,
-        K_UP:       CTRL.ARROW_UP,
-        K_a:        CTRL.WORLD_LEFT,
-        K_s:        CTRL.WORLD_DOWN,
-        K_d:        CTRL.WORLD_RIGHT,
-        K_w:        CTRL.WORLD_UP,
-        K_SPACE:    CTRL.GRAB,
-        K_q:        CTRL.QUIT,
-        K_MINUS:    CTRL.ZOOM_OUT,
-        K_EQUALS:   CTRL.ZOOM_IN,
-        K_1:        CTRL.K1,
-        K_2:        CTRL.K2,
-        K_3:        CTRL.K3,
-        K_4:        CTRL.K4,
-        K_LSHIFT:   CTRL.SHIFT,
-        K_LCTRL:    CTRL.CTRL,
-        K_b:        CTRL.DUMP,
-        K_n:        CTRL.LOAD,
-        }
-
-# TODO
-PYGAME_POINTER_MAP = {
-        1: CTRL.LEFT_BUTTON,
-        2: CTRL.MIDDLE_BUTTON,
-        3: CTRL.RIGHT_BUTTON,
-        4: CTRL.ZOOM_IN,
-        5: CTRL.ZOOM_OUT,
-        }
+if pygame is not None:
+    PYGAME_KB_MAP = {
+            K_LEFT:     CTRL.ARROW_LEFT,
+            K_DOWN:     CTRL.ARROW_DOWN,
+            K_RIGHT:    CTRL.ARROW_RIGHT,
+            K_UP:       CTRL.ARROW_UP,
+            K_a:        CTRL.WORLD_LEFT,
+            K_s:        CTRL.WORLD_DOWN,
+            K_d:        CTRL.WORLD_RIGHT,
+            K_w:        CTRL.WORLD_UP,
+            K_SPACE:    CTRL.GRAB,
+            K_q:        CTRL.QUIT,
+            K_MINUS:    CTRL.ZOOM_OUT,
+            K_EQUALS:   CTRL.ZOOM_IN,
+            K_1:        CTRL.K1,
+            K_2:        CTRL.K2,
+            K_3:        CTRL.K3,
+            K_4:        CTRL.K4,
+            K_LSHIFT:   CTRL.SHIFT,
+            K_LCTRL:    CTRL.CTRL,
+            K_b:        CTRL.DUMP,
+            K_n:        CTRL.LOAD,
+            K_F3:       CTRL.TIMINGS,
+            K_r:        CTRL.RETRY,
+            K_z:        CTRL.REWIND,
+            }
+
+    # TODO
+    PYGAME_POINTER_MAP = {
+            1: CTRL.LEFT_BUTTON,
+            2: CTRL.MIDDLE_BUTTON,
+            3: CTRL.RIGHT_BUTTON,
+            4: CTRL.ZOOM_IN,
+            5: CTRL.ZOOM_OUT,
+            }
 
 # may be a controller event or a pointer event
 # controller id may be added in future to allow multiplayer
-class TOGEvent:
+class TOGEvent(object):
     # 'None' serves as a wildcard
-    def __init__(self, code, position = None, pressed = True):
+    # position is always expressed by world coordinates. Pointer events
+    # may carry the screen position instead, together with a function
+    # converting it; the conversion is made when the position is first used.
+    # 'delta' is the screen movement of a (coalesced) MOUSE_MOTION event.
+    def __init__(self, code, position = None, pressed = True,
+            screenPosition = None, worldCoord = None, delta = None):
         self.code = code
         self.pressed = pressed
+        self.position_ = position
+        self.screenPosition = screenPosition
+        self.worldCoord = worldCoord
+        self.delta = delta
 
-        # position is always expressed by world coordinates
-        self.position = None
-        if position:
-            self.position = graphics.Graphics.instance.worldCoord(position)
+    @property
+    def position(self):
+        if self.position_ is None and self.screenPosition is not None \
+                and self.worldCoord is not None:
+            self.position_ = self.worldCoord(self.screenPosition)
+        return self.position_
 
     @property
     def released(self):
@@ -102,63 +127,135 @@ class CBInfo:
 
     def handle (self, togEvent):
         if self.event.matches(togEvent):
-            if self.withInfo: self.callback(togEvent)
-            else: self.callback()
+            self.invoke(togEvent)
+
+    def invoke(self, togEvent):
+        if self.withInfo: self.callback(togEvent)
+        else: self.callback()
 
+# the controls bus of a session
 class Controls:
-    # SINGLETON class
-    __metaclass__ = utils.Singleton
+    # converts screen positions of pointer events to world coordinates,
+    # set by the renderer (see Graphics); without it pointer events carry
+    # no position
+    worldCoord = None
+    # gets every dispatched event (see replay.InputRecorder)
+    recorder = None
 
-    def __init__(self):
+    # 'coalesceMotion' merges all MOUSEMOTION events read in one
+    # dispatchEvents call (up to the next other event) into a single event
+    def __init__(self, coalesceMotion = False):
+        self.coalesceMotion = coalesceMotion
         self.cbs = {}
-        self.ids = (i for i in xrange(1,2*10**9)) # dirty
+        self.ids = itertools.count(1)
+        # (code, pressed) -> {ID: CBInfo} in the order of subscription,
+        # pressed = None holds the callbacks that don't care about it
+        self.index = {}
 
     def subscribeTo(self, cbInfo):
         ID = self.ids.next()
         self.cbs[ID] = cbInfo
+        key = (cbInfo.event.code, cbInfo.event.pressed)
+        self.index.setdefault(key, OrderedDict())[ID] = cbInfo
         return ID
 
+    # Callbacks are called in the order of subscription. The callbacks to
+    # call are chosen before the first one is called: callbacks subscribed
+    # during the dispatch don't get the event and the unsubscribed ones are
+    # skipped.
     def dispatchEvent_(self, togEvent):
-        for cbInfo in self.cbs.values():
-            cbInfo.handle(togEvent)
+        if self.recorder is not None:
+            self.recorder.record(togEvent)
+
+        exact = self.index.get((togEvent.code, togEvent.pressed))
+        wildcard = self.index.get((togEvent.code, None))
+
+        if exact and wildcard:
+            handlers = sorted(exact.items() + wildcard.items())
+        elif exact:
+            handlers = exact.items()
+        elif wildcard:
+            handlers = wildcard.items()
+        else:
+            return
+
+        cbs = self.cbs
+        for ID, cbInfo in handlers:
+            if ID in cbs:
+                cbInfo.invoke(togEvent)
 
     def unsubscribe(self, callbackID):
-        del self.cbs[callbackID]
+        cbInfo = self.cbs.pop(callbackID)
+        key = (cbInfo.event.code, cbInfo.event.pressed)
+        bucket = self.index[key]
+        del bucket[callbackID]
+        if not bucket:
+            del self.index[key]
 
     # loop through all the events provided by pygame.event
     # and call appropriate callbacks for every event
     def dispatchEvents(self):
+        motion = None # [position, dx, dy] of the coalesced motion events
         for event in pygame.event.get():
-            position = None
-            code = None
-            pressed = False
-
-            # creating TOGEevent
-            if event.type in [KEYDOWN, KEYUP] and event.key in PYGAME_KB_MAP:
-                pressed = event.type == KEYDOWN
-                code = PYGAME_KB_MAP[event.key]
-
-            elif event.type in [MOUSEBUTTONUP, MOUSEBUTTONDOWN] and \
-                    event.button in PYGAME_POINTER_MAP:
-                pressed = event.type == MOUSEBUTTONDOWN
-                code = PYGAME_POINTER_MAP[event.button]
-                position = event.pos
-
-            elif event.type in [MOUSEMOTION]:
-                code = CTRL.MOUSE_MOTION
-                position = event.pos
-
-            else:
-                print event
+            if event.type == MOUSEMOTION and self.coalesceMotion:
+                if motion is None: motion = [event.pos, 0, 0]
+                motion[0] = event.pos
+                motion[1] += event.rel[0]
+                motion[2] += event.rel[1]
                 continue
 
-            # dispatch
-            self.dispatchEvent_(TOGEvent(
-                code, pressed = pressed, position = position))
+            # the order of events is kept
+            if motion is not None:
+                self.dispatchMotion_(*motion)
+                motion = None
+
+            self.dispatchPygameEvent_(event)
+
+        if motion is not None:
+            self.dispatchMotion_(*motion)
+
+    def dispatchMotion_(self, position, dx, dy):
+        self.dispatchEvent_(TOGEvent(
+            CTRL.MOUSE_MOTION, pressed = False, screenPosition = position,
+            worldCoord = self.worldCoord, delta = (dx, dy)))
+
+    def dispatchPygameEvent_(self, event):
+        position = None
+        code = None
+        pressed = False
+        delta = None
+
+        # creating TOGEevent
+        if event.type in [KEYDOWN, KEYUP] and event.key in PYGAME_KB_MAP:
+            pressed = event.type == KEYDOWN
+            code = PYGAME_KB_MAP[event.key]
+
+        elif event.type in [MOUSEBUTTONUP, MOUSEBUTTONDOWN] and \
+                event.button in PYGAME_POINTER_MAP:
+            pressed = event.type == MOUSEBUTTONDOWN
+            code = PYGAME_POINTER_MAP[event.button]
+            position = event.pos
+
+        elif event.type in [MOUSEMOTION]:
+            code = CTRL.MOUSE_MOTION
+            position = event.pos
+            delta = event.rel
+
+        else:
+            print event
+            return
+
+        # dispatch
+        self.dispatchEvent_(TOGEvent(
+            code, pressed = pressed, screenPosition = position,
+            worldCoord = self.worldCoord, delta = delta))
 
 
+# a group of callbacks subscribed to (and unsubscribed from) a controls bus
+# together
 class ControlsCapsule:
-    def __init__(self, callbacks = None):
+    def __init__(self, controls, callbacks = None):
+        self.bus = controls
         self.callbackIDs = []
         self.callbacks = []
         if callbacks:
@@ -167,7 +264,7 @@ class ControlsCapsule:
 
     def addCallback (self, cbInfo):
         self.callbacks.append(cbInfo)
-        ID = Controls().subscribeTo(cbInfo)
+        ID = self.bus.subscribeTo(cbInfo)
         self.callbackIDs.append(ID)
 
     def subscribe(self):
@@ -180,6 +277,6 @@ class ControlsCapsule:
 
     def unsubscribe(self):
         for x in self.callbackIDs:
-            Controls().unsubscribe(x)
+            self.bus.unsubscribe(x)
 
         del self.callbackIDs[:]
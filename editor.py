@@ -7,11 +7,12 @@ your mouse.
 import Box2D as b2d
 import settings
 import graphics
+import session
 import objects
+import autosave
 from levels import Level
 from game import Game
 from controls import Controls, CBInfo, TOGEvent, CTRL, CTRL, ControlsCapsule
-import pickle
 
 
 class MouseControlled(object):
@@ -25,7 +26,7 @@ class MouseControlled(object):
     def mouseMotion(self, togEvent): pass
 
     def createControls(self):
-        self.controls = ControlsCapsule()
+        self.controls = ControlsCapsule(self.level.session.controls)
         for button in self.buttons:
             self.controls.addCallback(CBInfo(
                 ev = TOGEvent(code = button),
@@ -192,6 +193,8 @@ class Resizer(MouseControlled):
 class EditorLevel(Level):
     currentBuilder = None
     cameraPosition = None
+    filename = 'level.tog'
+    saver = None # autosave.LevelSaver
 
     def timeLeft(self):
         return 1
@@ -203,12 +206,33 @@ class EditorLevel(Level):
     def __init__(self, *args, **kwargs):
         self.cameraPosition = CameraUpdater(self)
         super(EditorLevel,  self).__init__(*args, **kwargs)
+        self.saver = autosave.LevelSaver()
+
+        interval = self.settings.autosave_interval
+        if interval:
+            self.scheduler.addAction(
+                    fun = self.autosave,
+                    delay = interval,
+                    interval = interval,
+                    callsNo = -1)
+
+    # saving doesn't stop the editor, the level is written by the saver's
+    # worker thread
+    def save(self):
+        self.saver.save(self.filename, self.actors)
+
+    def autosave(self):
+        self.saver.save(self.settings.autosave_file, self.actors)
+
+    def load(self):
+        self.saver.flush()
+        self.loadData(self.filename)
 
     def constructWorld(self):
         super(EditorLevel, self).constructWorld()
         self.constructFrame()
 
-    def getCameraPosition(self):
+    def getCameraPosition(self, alpha = 1.):
         return self.cameraPosition.get()
 
     def updateWorld(self):
@@ -264,11 +288,11 @@ class EditorLevel(Level):
 
         self.controls.addCallback(CBInfo(
                 ev = TOGEvent(code = CTRL.DUMP),
-                cb = self.dumpPickledData))
+                cb = self.save))
 
         self.controls.addCallback(CBInfo(
                 ev = TOGEvent(code = CTRL.LOAD),
-                cb = self.loadPickledData))
+                cb = self.load))
 
         # releasing a key disposes the current builder
         for key in (CTRL.K1, CTRL.K2, CTRL.SHIFT, CTRL.CTRL):
@@ -277,9 +301,10 @@ class EditorLevel(Level):
                     cb = self.stopBuilder))
 
 if __name__=='__main__':
-    st = settings.Settings()
-    lvl = EditorLevel(st)
-    gr = graphics.Graphics(st, lvl)
+    sess = session.Session(settings.Settings())
+    sess.level = EditorLevel(sess)
+    sess.graphics = graphics.Graphics(sess)
 
-    g = Game(lvl, st, gr)
+    g = Game(sess)
     g.start()
+    sess.level.saver.close()
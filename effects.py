@@ -0,0 +1,96 @@
+# Short-lived effects of a level ("POW!", "scored", what the gorilla says).
+#
+# The effects are not actors of the level: 'capacity' instances of every
+# effect class are created up front and reused, and at most 'capacity'
+# effects are shown at once (new ones are dropped when the pool is full).
+# Effects of the same group (see objects.Effect.group) are deduplicated,
+# at most one of them is shown in a cell of size 'cell' x 'cell' per
+# 'interval' seconds. Expired effects are returned to the pool by sweep(),
+# which is called once per world step.
+class EffectPool:
+    def __init__(self, clock, classes, capacity = 64, cell = 4.,
+            interval = 0.1):
+        self.clock = clock
+        self.capacity = capacity
+        self.cell = float(cell)
+        self.interval = interval
+        self.free = dict((cls, [cls() for i in xrange(capacity)])
+                for cls in classes)
+        self.live = [] # [(expiresAt, effect)], in the order of spawning
+        self.recent = {} # (group, cell x, cell y) -> time of the last effect
+        self.dropped = 0
+        self.deduplicated = 0
+
+    # shows an effect of the class 'cls' for 'lifetime' seconds, returns
+    # the effect or None if it was dropped
+    def spawn(self, cls, position, lifetime, rng):
+        now = self.clock.now()
+        if cls.group is not None:
+            key = (cls.group,
+                    int(position[0] // self.cell),
+                    int(position[1] // self.cell))
+            last = self.recent.get(key)
+            if last is not None and now - last < self.interval:
+                self.deduplicated += 1
+                return None
+
+        if len(self.live) >= self.capacity:
+            self.dropped += 1
+            return None
+
+        # only a shown effect blocks its cell
+        if cls.group is not None: self.recent[key] = now
+        effect = self.free[cls].pop()
+        effect.reset(position, rng)
+        self.live.append((now + lifetime, effect))
+        return effect
+
+    def sweep(self):
+        now = self.clock.now()
+        live = []
+        for entry in self.live:
+            if entry[0] <= now:
+                effect = entry[1]
+                self.free[type(effect)].append(effect)
+            else:
+                live.append(entry)
+        self.live = live
+
+        if self.recent:
+            interval = self.interval
+            for key, t in self.recent.items():
+                if now - t >= interval:
+                    del self.recent[key]
+
+    def clear(self):
+        for expiresAt, effect in self.live:
+            self.free[type(effect)].append(effect)
+        self.live = []
+        self.recent.clear()
+
+    # the shown effects and the deduplication state (see restore)
+    def snapshot(self):
+        return ([(expiresAt, type(e), e.position, e.angle, e.spr_name)
+                for expiresAt, e in self.live], dict(self.recent))
+
+    def restore(self, (live, recent)):
+        self.clear()
+        for expiresAt, cls, position, angle, spr_name in live:
+            effect = self.free[cls].pop()
+            effect.position = position
+            effect.angle = angle
+            effect.spr_name = spr_name
+            self.live.append((expiresAt, effect))
+        self.recent.update(recent)
+
+    # the effects within the given world rectangle, in the order of spawning
+    def visible(self, x0, y0, x1, y1):
+        res = []
+        for expiresAt, effect in self.live:
+            x,y = effect.position[0], effect.position[1]
+            if x0 <= x <= x1 and y0 <= y <= y1:
+                res.append(effect)
+        return res
+
+    def __len__(self):
+        return len(self.live)
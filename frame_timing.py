@@ -0,0 +1,110 @@
+import time
+from array import array
+
+PHASES = (
+    'dispatchEvents',
+    'scheduler',
+    'physicsStep',
+    'contacts',
+    'paintBackground',
+    'paintWorld',
+    'flip',
+    )
+
+class Phase_:
+    def __init__(self, timer, column):
+        self.timer = timer
+        self.column = column
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.time()
+
+    def __exit__(self, *exc):
+        self.timer.current[self.column] += time.time() - self.started
+
+
+# Measures how long every phase of a frame takes.
+# A phase may be entered several times per frame (e.g. when the world is
+# stepped more than once), its durations are summed up. The durations of the
+# last 'capacity' frames are kept in a ring buffer.
+#
+#   with timer.phase('paintWorld'):
+#       ...
+#   timer.endFrame()
+class FrameTimer:
+    def __init__(self, phases = PHASES, capacity = 600):
+        self.phases = tuple(phases)
+        self.capacity = capacity
+        self.samples = array('d', [0.]) * (capacity * len(self.phases))
+        self.current = [0.] * len(self.phases)
+        self.frames = 0
+        self.phases_ = dict((name, Phase_(self, i))
+                for i, name in enumerate(self.phases))
+
+    def phase(self, name):
+        return self.phases_[name]
+
+    def endFrame(self):
+        n = len(self.phases)
+        row = (self.frames % self.capacity) * n
+        self.samples[row:row+n] = array('d', self.current)
+        self.current = [0.] * n
+        self.frames += 1
+
+    # rows of the stored frames, the oldest first
+    def rows(self):
+        n = len(self.phases)
+        stored = min(self.frames, self.capacity)
+        first = self.frames - stored
+        for frame in xrange(first, self.frames):
+            row = (frame % self.capacity) * n
+            yield frame, self.samples[row:row+n]
+
+    # phase -> (p50, p95, max) in seconds over the stored frames
+    def summary(self):
+        columns = [[] for _ in self.phases]
+        for _, row in self.rows():
+            for column, value in zip(columns, row):
+                column.append(value)
+
+        res = {}
+        for name, values in zip(self.phases, columns):
+            if not values:
+                res[name] = (0., 0., 0.)
+                continue
+            values.sort()
+            last = len(values) - 1
+            res[name] = (
+                values[int(0.50 * last)],
+                values[int(0.95 * last)],
+                values[last])
+        return res
+
+    def dumpCsv(self, filename):
+        with open(filename, 'w') as f:
+            f.write(','.join(('frame',) + self.phases) + '\n')
+            for frame, row in self.rows():
+                f.write(','.join([str(frame)] + ['%.6f' % x for x in row]))
+                f.write('\n')
+
+
+class NullPhase_:
+    def __enter__(self): pass
+    def __exit__(self, *exc): pass
+
+# does not measure anything, used when no FrameTimer is attached
+class NullFrameTimer:
+    phase_ = NullPhase_()
+    phases = ()
+    frames = 0
+
+    def phase(self, name):
+        return self.phase_
+
+    def endFrame(self): pass
+
+    def summary(self):
+        return {}
+
+NULL_TIMER = NullFrameTimer()
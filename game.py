@@ -1,24 +1,45 @@
 import pygame
+import time
 import settings
+import session
+import frame_timing
+import replay
 import graphics
 from pygame.locals import *
 from levels import PickledLevel
 from controls import Controls, CBInfo, TOGEvent, CTRL, ControlsCapsule
 
 class Game:
-    def __init__(self, level, settings, graph):
-        self.level = level
-        self.settings = settings
-        self.graph = graph
+    # 'inputLog' (a replay.InputLog) is replayed into the session
+    def __init__(self, session, inputLog = None):
+        self.session = session
+        self.level = session.level
+        self.settings = session.settings
+        self.graph = session.graphics
         self.running = True
 
+        self.timer = frame_timing.FrameTimer(
+                capacity = self.settings.timing_frames)
+        session.timer = self.timer
+
+        self.recorder = None
+        if self.settings.record_input:
+            self.recorder = replay.InputRecorder(
+                    self.settings.record_input, self.level, session.seed)
+            session.controls.recorder = self.recorder
+
+        self.replay = None
+        if inputLog is not None:
+            self.replay = replay.InputReplay(
+                    inputLog, session.controls, self.level)
+
         self.createControls()
 
 
     def createControls(self):
         self.graph.createControls()
 
-        self.controls = ControlsCapsule ([
+        self.controls = ControlsCapsule (self.session.controls, [
             CBInfo(
                 TOGEvent(code = CTRL.QUIT),
                 cb = self.quit),
@@ -31,19 +52,56 @@ class Game:
     def start(self):
         self.level.constructWorld()
         self.level.createControls()
+        self.graph.warmUp()
         clock = pygame.time.Clock()
 
+        # The world is stepped at settings.hz in wall time, independently
+        # of how often frames are drawn. Frames are interpolated between the
+        # last two world steps.
+        dt = self.settings.time_step
+        accumulator = 0.
+        previous = time.time()
+
         while self.running:
-            Controls().dispatchEvents()
-            self.level.updateWorld()
-            self.graph.paint()
-            clock.tick(self.settings.hz)
-            #print clock.get_fps(), 'fps'
+            now = time.time()
+            accumulator += now - previous
+            previous = now
+
+            with self.timer.phase('dispatchEvents'):
+                self.session.controls.dispatchEvents()
+
+            steps = 0
+            while accumulator >= dt:
+                if steps == self.settings.max_steps_per_frame:
+                    # the machine can't keep up, drop the backlog instead
+                    # of falling further behind with every frame
+                    accumulator = 0.
+                    break
+                if self.replay: self.replay.dispatchDue()
+                self.level.updateWorld()
+                accumulator -= dt
+                steps += 1
+
+            self.graph.paint(accumulator / dt)
+            self.timer.endFrame()
+            clock.tick(self.settings.max_fps)
+
+        if self.settings.timing_csv:
+            self.timer.dumpCsv(self.settings.timing_csv)
+        if self.recorder:
+            self.recorder.close()
 
 if __name__=='__main__':
     st = settings.Settings()
-    lvl = PickledLevel('pickle.data', st)
-    gr = graphics.Graphics(st, lvl)
+    seed = None
+    inputLog = None
+    if st.replay_input:
+        inputLog = replay.InputLog.load(st.replay_input)
+        # the replayed session must use the seed of the recorded one
+        seed = inputLog.seed
+    sess = session.Session(st, seed)
+    sess.level = PickledLevel('level.tog', sess)
+    sess.graphics = graphics.Graphics(sess)
 
-    g = Game(lvl, st, gr)
+    g = Game(sess, inputLog)
     g.start()
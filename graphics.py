@@ -6,17 +6,37 @@ import random
 import itertools
 import Box2D as b2d
 from levels import ContactType
+import objects
+import tween
+from sprite_cache import SpriteCache, RotationCache
+from text_renderer import TextRenderer, Hud
+from background import BackgroundLayer
+from camera import Camera
 from controls import Controls, CBInfo, TOGEvent, CTRL, ControlsCapsule
 
 class Graphics:
-    __metaclass__ = utils.Singleton
-
     zoom = None
-
-    def __init__(self, settings, level):
+    stats = None
+    # position of the drawn frame between the previous and the current
+    # world step (see Game.start)
+    alpha = 1.
+    showTimings = False
+    timingsSummary = None
+    timingsAt = None # wall time of the last refresh of timingsSummary
+
+    def __init__(self, session):
+        settings = session.settings
+        self.session = session
         self.settings = settings
-        self.level = level
-        self.zoom = utils.SmoothChanger(5)
+        self.level = session.level
+        # animations of the view, driven by the wall clock
+        self.tweens = tween.TweenEngine()
+        self.zoom = self.tweens.create(5)
+        self.camera = Camera(settings)
+        self.stats = {'drawn': 0, 'culled': 0}
+        self.queryCapacity = 64
+        self.sprites = SpriteCache(settings)
+        self.rotations = RotationCache(self.sprites, settings)
 
         pygame.init()
         pygame.display.set_caption('Theory of Gravitation')
@@ -29,6 +49,12 @@ class Graphics:
 
         self.screen = pygame.display.set_mode(settings.screen_size, flags)
 
+        self.text = TextRenderer(settings)
+        self.hud = Hud(self.text)
+        self.background = BackgroundLayer(self, settings)
+
+        session.controls.worldCoord = self.worldCoord
+
 
     def zoomIn(self):
         self.zoom.init_change(1)
@@ -37,111 +63,181 @@ class Graphics:
         self.zoom.init_change(-1)
 
     def circle(self, color, position, radius):
-        #print position, self.screenCoord(position)
-        #print radius, self.scaleLength(radius)
         pygame.draw.circle(
                 self.screen,
                 color,
-                self.screenCoord(position),
-                self.scaleLength(radius),
+                self.camera.toScreen(position[0], position[1]),
+                self.camera.scaleLength(radius),
                 0)
 
-    def putSprite(self, position, spr_name, (we, he), angle=0, **kwargs):
-        x,y = self.screenCoord(position)
-        we,he = self.scaleLength(we), self.scaleLength(he)
-        sprite = utils.get_bitmap(spr_name, 2*we, 2*he, **kwargs)
-        if angle:
-            sprite = pygame.transform.rotate(sprite, angle)
+    def putSprite(self, position, spr_name, size, angle=0, **kwargs):
+        self.blitSprite(self.screen,
+                self.camera.toScreen(position[0], position[1]),
+                spr_name, size, angle, **kwargs)
+
+    # (x,y) are the coordinates of the sprite's center on the target surface
+    def blitSprite(self, target, (x,y), spr_name, (we, he), angle=0, **kwargs):
+        we,he = self.camera.scaleLength(we), self.camera.scaleLength(he)
+        sprite = self.rotations.get(spr_name, 2*we, 2*he, angle, **kwargs)
         w,h = sprite.get_size()
         x,y = x-w/2, y-h/2
 
-        self.screen.blit(
+        target.blit(
                 sprite,
                 (x,y))
 
+    # pre-renders a sprite in the given angles at the current zoom level
+    # ('angles' defaults to every angle the rotation cache distinguishes)
+    def warmUpSprite(self, spr_name, (we, he), angles=None, **kwargs):
+        we,he = self.scaleLength(we), self.scaleLength(he)
+        if angles is None: angles = self.rotations.allAngles()
+        self.rotations.warmUp(spr_name, 2*we, 2*he, angles, **kwargs)
+
+    # pre-renders the sprites of the current level and of the effects
+    # that may appear on it
+    def warmUp(self):
+        self.updateCamera()
+        for actor in self.level.actors.values():
+            actor.warmUp(self)
+        objects.warmUpEffects(self)
+
+    def putSurface(self, surf, position):
+        self.screen.blit(surf, surf.get_rect(center = position))
+
     def putText(self, text, position, color = (20,240,30)):
-        font = pygame.font.Font(pygame.font.match_font('dejavusansmono', bold=True), 70)
-        text = font.render(text, 1, color)
-        textpos = text.get_rect(center = position)
-        self.screen.blit(text, textpos)
+        self.putSurface(self.text.render(text, color), position)
 
     def printStats(self):
         W,H = self.settings.screen_size
-        self.putText(str(self.level.timeLeft()), (80,50))
-        self.putText(str(self.level.score), (W-80,50))
+        color = (20,240,30)
+        timeLeft = self.level.timeLeft()
+        self.putSurface(self.hud.field('time', timeLeft, color), (80,50))
+        self.putSurface(self.hud.field('score', self.level.score, color), (W-80,50))
 
-        if self.level.timeLeft() <= 0.01:
+        if timeLeft <= 0.01:
             y = (time.time()*150) % H
             self.putText("GAME OVER LOL", (W/2,y), color = (250, 110, 110))
 
+    def toggleTimings(self):
+        self.showTimings = not self.showTimings
+
+    # p50 / p95 / max of every frame phase, refreshed twice a second
+    def paintTimings(self):
+        timer = self.session.timer
+        now = time.time()
+        if self.timingsAt is None or now - self.timingsAt >= 0.5:
+            self.timingsSummary = timer.summary()
+            self.timingsAt = now
+
+        lines = ['%-16s %6s %6s %6s' % ('ms', 'p50', 'p95', 'max')]
+        for name in timer.phases:
+            lines.append('%-16s %6.2f %6.2f %6.2f' % ((name,) +
+                    tuple(1000 * x for x in self.timingsSummary[name])))
+        lines.append('drawn %(drawn)d culled %(culled)d' % self.stats)
+
+        color = (240,240,240)
+        for i, line in enumerate(lines):
+            surf = self.text.render(line, color, size = 14)
+            self.screen.blit(surf, (10, 100 + 16*i))
+
     def polygon(self, color, points):
-        #print points
-        points = map(self.screenCoord, points)
+        pygame.draw.polygon(self.screen, color, self.camera.toScreenMany(points))
+
+    # a polygon given by body-local vertices of a body at 'position'
+    # rotated by 'angle'
+    def bodyPolygon(self, color, vertices, position, angle):
+        points = self.camera.toScreenLocal(vertices, position, angle)
         pygame.draw.polygon(self.screen, color, points)
 
+    # actors within the given world rectangle (e.g. the one seen by the
+    # camera), in the order of their ids
+    def visibleActors(self, (x0,y0,x1,y1)):
+        aabb = b2d.b2AABB()
+        aabb.lowerBound = (x0, y0)
+        aabb.upperBound = (x1, y1)
+
+        # Query returns at most 'queryCapacity' shapes; ask again with
+        # a larger buffer if it was filled up
+        while True:
+            num, shapes = self.level.world.Query(aabb, self.queryCapacity)
+            if num < self.queryCapacity: break
+            self.queryCapacity *= 2
+
+        actors = self.level.actors
+        visible = {}
+        for shape in shapes:
+            actor = shape.GetBody().userData
+            # bodies of removed actors live until the end of the world step
+            if actors.get(actor.id) is actor:
+                visible[actor.id] = actor
+
+        for actor in self.level.sprites.values():
+            x,y = actor.position[0], actor.position[1]
+            if x0 <= x <= x1 and y0 <= y <= y1:
+                visible[actor.id] = actor
+
+        return [visible[i] for i in sorted(visible)]
+
     def paintWorld(self):
-        for actor in self.level.actors.values():
+        bounds = self.camera.worldBounds(self.settings.cull_margin)
+        # effects are drawn over the actors
+        visible = self.visibleActors(bounds)
+        visible += self.level.effects.visible(*bounds)
+        for actor in visible:
             actor.draw(self)
+
+        total = len(self.level.actors) + len(self.level.effects)
+        self.stats['drawn'] = len(visible)
+        self.stats['culled'] = total - len(visible)
         self.printStats()
 
     def paintBackground(self):
         self.screen.fill((0,0,0))
-        W,H = self.level.size
-        w,h = 30,30
-        for x in range(0,W,w*2):
-            for y in range(0,H,h*2):
-                self.putSprite((x+w/2,y+w/2), './sprites/cogwheel.png', (w/2,h/2))
-        
-
-    def paint(self):
-        self.zoom.step()
-        self.paintBackground()
-        self.paintWorld()
-        pygame.display.flip()
-
-    def getScale(self):
+        self.background.paint(self.screen)
+
+    def paint(self, alpha = 1.):
+        self.alpha = alpha
+        self.tweens.step()
+        self.updateCamera()
+        timer = self.session.timer
+        with timer.phase('paintBackground'):
+            self.paintBackground()
+        with timer.phase('paintWorld'):
+            self.paintWorld()
+        if self.showTimings:
+            self.paintTimings()
+        with timer.phase('flip'):
+            pygame.display.flip()
+
+    def computeScale(self):
         sw,sh = self.settings.screen_size
-        scale = 1. * sw / self.level.size[0] 
+        scale = 1. * sw / self.level.size[0]
         scale *= self.settings.zoom_factor ** self.zoom.get()
         return scale
 
-    # screen coordinates -> world coordinates
-    def worldCoord(self, vec):
-        sw,sh = self.settings.screen_size
-
-        x,y = map(float, vec)
-        y += sh/2
-        x -= sw/2
-        y = sh-y
+    # takes the camera snapshot used by every conversion until the next frame
+    def updateCamera(self):
+        self.camera.update(
+                self.level.getCameraPosition(self.alpha),
+                self.level.world_angle.get(),
+                self.computeScale())
 
-        vec = b2d.b2Vec2(x,y)
-        vec *= 1./self.getScale()
-        vec = utils.rotate(vec, self.level.world_angle.get())
+    def getScale(self):
+        return self.camera.scale
 
-        vec += self.level.getCameraPosition()
-        return vec
+    # screen coordinates -> world coordinates
+    def worldCoord(self, vec):
+        return b2d.b2Vec2(*self.camera.toWorld(vec[0], vec[1]))
 
     # world coordinates -> screen coordinates
     def screenCoord(self, vec):
-        if type(vec)==tuple: vec = b2d.b2Vec2(*vec)
-        vec = vec.copy()
-        vec -= self.level.getCameraPosition()
-
-        sw,sh = self.settings.screen_size
-        vec = utils.rotate(vec, -self.level.world_angle.get())
-
-        vec *= self.getScale()
-        x,y = map(int,vec)
-        y = sh - y
-        x += sw/2
-        y -= sh/2
-        return (x,y)
+        return self.camera.toScreen(vec[0], vec[1])
 
     def scaleLength(self, length):
-        return int(length*self.getScale())
+        return self.camera.scaleLength(length)
 
     def createControls(self):
-        self.controls = ControlsCapsule ([
+        self.controls = ControlsCapsule (self.session.controls, [
             CBInfo(
                 ev = TOGEvent(code = CTRL.ZOOM_OUT),
                 cb = self.zoomOut),
@@ -149,4 +245,8 @@ class Graphics:
             CBInfo(
                 ev = TOGEvent(code = CTRL.ZOOM_IN),
                 cb = self.zoomIn),
+
+            CBInfo(
+                ev = TOGEvent(code = CTRL.TIMINGS),
+                cb = self.toggleTimings),
             ])
@@ -1,13 +1,15 @@
 import utils
 import math
 from controls import Controls, CBInfo, TOGEvent, CTRL, ControlsCapsule
-import levels
 
 # Gravity changers listen to keyboard actions and update
 # the world angle accordingly. This may be used in more general scope in future.
 class GravityChangerBase:
-    def __init__(self):
-        self.world_angle = utils.SmoothChanger(0)
+    # the world angle is animated by the tween engine of the level, which
+    # is driven by the simulation clock
+    def __init__(self, level):
+        self.level = level
+        self.world_angle = level.tweens.create(0)
 
     def createControls(self):
         raise NotImplementedError
@@ -15,19 +17,28 @@ class GravityChangerBase:
     def get(self):
         return self.world_angle.get()
 
-    def step(self):
-        self.world_angle.step()
+    # the angle the world is turning to, the current one if it's not turning
+    def goal(self):
+        return self.world_angle.goal()
+
+    def isRotating(self):
+        return self.world_angle.isRunning()
+
+    # the world angle is a tween of the level, it's a part of the level's
+    # snapshot already
+    def snapshot(self):
+        return None
+
+    def restore(self, state):
+        pass
 
 class ConstantGravity(GravityChangerBase):
     def createControls(self):
-        self.controls = ControlsCapsule()
+        self.controls = ControlsCapsule(self.level.session.controls)
 
 class GravityChanger(GravityChangerBase):
-    def __init__(self):
-        self.world_angle = utils.SmoothChanger(0)
-
     def createControls(self):
-        self.controls = ControlsCapsule ([
+        self.controls = ControlsCapsule (self.level.session.controls, [
                 CBInfo(
                     TOGEvent(code = CTRL.WORLD_LEFT),
                     cb = self.GravityLeft),
@@ -59,22 +70,37 @@ class GravityChanger(GravityChangerBase):
 class ContinuousGravityChanger(GravityChangerBase):
     TIMEDELTA = 0.02 # ~ 50 times per sec
     DELTA = 0.04
-    def __init__(self):
+    def __init__(self, level):
+        self.level = level
         self.world_angle = 0.
         self.GravityLeft = utils.ContinuousAction(
-                levels.G_FS,
+                level.scheduler,
                 fun = self.GravityLeftFun,
                 interval = self.TIMEDELTA)
         self.GravityRight = utils.ContinuousAction(
-                levels.G_FS,
+                level.scheduler,
                 fun = self.GravityRightFun,
                 interval = self.TIMEDELTA)
 
     def get(self):
         return self.world_angle
 
-    def step(self):
-        self.world_angle
+    def goal(self):
+        return self.world_angle
+
+    def isRotating(self):
+        return self.GravityLeft.actionId is not None or \
+                self.GravityRight.actionId is not None
+
+    def snapshot(self):
+        return (self.world_angle,
+                self.GravityLeft.snapshot(),
+                self.GravityRight.snapshot())
+
+    def restore(self, (world_angle, left, right)):
+        self.world_angle = world_angle
+        self.GravityLeft.restore(left)
+        self.GravityRight.restore(right)
 
     def GravityLeftFun(self):
         self.world_angle += self.DELTA
@@ -83,7 +109,7 @@ class ContinuousGravityChanger(GravityChangerBase):
         self.world_angle -= self.DELTA
 
     def createControls(self):
-        self.controls = ControlsCapsule ([
+        self.controls = ControlsCapsule (self.level.session.controls, [
                 CBInfo(
                     ev = TOGEvent(code = CTRL.WORLD_LEFT),
                     cb = self.GravityLeft.start),
@@ -0,0 +1,149 @@
+"""
+Runs a level without graphics, as fast as possible, and reports the score
+and how long the world steps took:
+
+    python headless.py level.tog --input session.log
+    python headless.py level.tog --script moves.txt --seed 7 --json
+
+The input comes from a recorded input log (see replay.InputRecorder) or an
+input script (see replay.parseScript). Neither pygame's display nor any
+of the rendering modules are used.
+"""
+import ast
+import json
+import time
+import argparse
+import settings
+import session
+import frame_timing
+import replay
+from levels import PickledLevel
+
+PHASES = ('step', 'scheduler', 'physicsStep', 'contacts')
+
+# the step times are reported over at most this many last steps, so that a
+# long run doesn't allocate its whole timing buffer up front
+MAX_TIMED_STEPS = 10000
+
+# returns Settings with the given name -> value overrides
+def makeSettings(overrides = None):
+    st = settings.Settings()
+    for name, value in (overrides or {}).items():
+        if not hasattr(st, name):
+            raise ValueError('unknown setting %s' % name)
+        setattr(st, name, value)
+    return st
+
+# Steps a level until its time is up (or 'maxSteps' steps are done),
+# feeding it the events of 'inputLog' (a replay.InputLog or None).
+class HeadlessRunner:
+    def __init__(self, sess, inputLog = None, maxSteps = None):
+        self.session = sess
+        self.level = sess.level
+        self.maxSteps = maxSteps
+        self.replay = None
+        if inputLog is not None:
+            self.replay = replay.InputReplay(inputLog, sess.controls,
+                    self.level)
+
+        capacity = maxSteps or int(sess.settings.time * sess.settings.hz) + 1
+        capacity = min(capacity, MAX_TIMED_STEPS)
+        self.timer = frame_timing.FrameTimer(PHASES, capacity)
+        sess.timer = self.timer
+
+    def done(self):
+        level = self.level
+        if level.timeLeft() <= 0: return True
+        return self.maxSteps is not None and level.steps >= self.maxSteps
+
+    def step(self):
+        if self.replay: self.replay.dispatchDue()
+        with self.timer.phase('step'):
+            self.level.updateWorld()
+        self.timer.endFrame()
+
+    def run(self):
+        level = self.level
+        level.constructWorld()
+        level.createControls()
+
+        started = time.time()
+        while not self.done():
+            self.step()
+        return self.result(time.time() - started)
+
+    def result(self, wallTime):
+        level = self.level
+        stepTime = {}
+        for name, (p50, p95, worst) in self.timer.summary().items():
+            stepTime[name] = {
+                'p50': p50 * 1000.,
+                'p95': p95 * 1000.,
+                'max': worst * 1000.,
+                }
+        return {
+            'seed': self.session.seed,
+            'score': level.score,
+            'steps': level.steps,
+            'simTime': level.clock.now(),
+            'timeLeft': level.timeLeft(),
+            'wallTime': wallTime,
+            'stepsPerSecond': level.steps / wallTime if wallTime else 0.,
+            'stepTime': stepTime, # phase -> ms
+            }
+
+# loads the level 'filename' into a new session and runs it
+def runLevel(filename, st = None, seed = None, inputLog = None,
+        maxSteps = None):
+    if st is None: st = settings.Settings()
+    if seed is None and inputLog is not None:
+        seed = inputLog.seed
+    sess = session.Session(st, seed)
+    sess.level = PickledLevel(filename, sess)
+    res = HeadlessRunner(sess, inputLog, maxSteps).run()
+    res['level'] = filename
+    return res
+
+def loadInput(inputFile = None, scriptFile = None):
+    if inputFile: return replay.InputLog.load(inputFile)
+    if scriptFile: return replay.parseScript(scriptFile)
+    return None
+
+def printResult(res):
+    print '%s: score %d after %d steps (%.1f s simulated)' % (
+            res['level'], res['score'], res['steps'], res['simTime'])
+    print '%.0f steps/s, %.2f s wall time' % (
+            res['stepsPerSecond'], res['wallTime'])
+    for name in PHASES:
+        t = res['stepTime'][name]
+        print '  %-12s p50 %.3f ms  p95 %.3f ms  max %.3f ms' % (
+                name, t['p50'], t['p95'], t['max'])
+
+def parseOverride(text):
+    name, _, value = text.partition('=')
+    try:
+        value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        pass # a plain string
+    return name, value
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description = 'Runs a level without graphics.')
+    parser.add_argument('level')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--input', help = 'recorded input log')
+    source.add_argument('--script', help = 'input script')
+    parser.add_argument('--seed', type = int)
+    parser.add_argument('--steps', type = int, help = 'maximal steps')
+    parser.add_argument('--set', action = 'append', default = [],
+            metavar = 'NAME=VALUE', help = 'overrides a setting')
+    parser.add_argument('--json', action = 'store_true',
+            help = 'prints the result as JSON')
+    args = parser.parse_args()
+
+    st = makeSettings(dict(parseOverride(x) for x in args.set))
+    res = runLevel(args.level, st, args.seed,
+            loadInput(args.input, args.script), args.steps)
+    if args.json: print json.dumps(res, sort_keys = True)
+    else: printResult(res)
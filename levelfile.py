@@ -0,0 +1,238 @@
+import struct
+import zlib
+import pickle
+import copy_reg
+
+# Level files: the actors of a level as typed, fixed-width records.
+#
+# File layout (little endian):
+#   header:  magic 'TOGL', version (uint16), flags (uint16), number of
+#            sections (uint16)
+#   payload: zlib compressed if flags & COMPRESSED, a section per actor kind:
+#     section: kind (uint8), number of records (uint32)
+#     record:  id (uint32), flags (uint8: STATIC, FIXED_ROTATION),
+#              x, y, angle, density, restitution, linear damping (float32),
+#              w, h of a box or radius of a ball (float32)
+#
+# Box2D keeps all of these in float32, so nothing is lost.
+#
+# Levels are passed around as lists of records, dicts with the fields
+# above ('kind' is the class name, 'position' an (x, y) tuple, 'size' a
+# (w, h) tuple and 'radius' a float), so that files can be converted without
+# Box2D and pygame (python levelfile.py pickle.data level.tog).
+
+MAGIC = 'TOGL'
+VERSION = 1
+HEADER = struct.Struct('<4sHHH')
+SECTION = struct.Struct('<BI')
+
+# header flags
+COMPRESSED = 1
+
+# record flags
+STATIC = 1
+FIXED_ROTATION = 2
+
+COMMON_FIELDS = ('angle', 'density', 'restitution', 'linearDamping')
+
+# kind code -> (class name, shape field, record struct)
+KINDS = {
+    1: ('Box', 'size', struct.Struct('<IB6f2f')),
+    2: ('Ball', 'radius', struct.Struct('<IB6ff')),
+    3: ('Candy', 'radius', struct.Struct('<IB6ff')),
+    4: ('Gorilla', 'radius', struct.Struct('<IB6ff')),
+    5: ('GorillaHut', 'size', struct.Struct('<IB6f2f')),
+    }
+KIND_CODES = dict((name, code) for code, (name, f, s) in KINDS.items())
+
+class LevelFileError(Exception): pass
+
+
+def isLevelFile(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def encodeRecord(code, record):
+    name, field, rec = KINDS[code]
+    flags = 0
+    if record['static']: flags |= STATIC
+    if record['fixedRotation']: flags |= FIXED_ROTATION
+    x,y = record['position']
+    values = [record[f] for f in COMMON_FIELDS]
+    if field == 'size': values.extend(record['size'])
+    else: values.append(record['radius'])
+    return rec.pack(record['id'], flags, x, y, *values)
+
+def decodeRecord(code, data, offset):
+    name, field, rec = KINDS[code]
+    values = rec.unpack_from(data, offset)
+    record = {
+        'kind': name,
+        'id': values[0],
+        'static': bool(values[1] & STATIC),
+        'fixedRotation': bool(values[1] & FIXED_ROTATION),
+        'position': values[2:4],
+        }
+    record.update(zip(COMMON_FIELDS, values[4:8]))
+    if field == 'size': record['size'] = values[8:10]
+    else: record['radius'] = values[8]
+    return record
+
+# the content of a level file with the given records
+def encode(records, compress = True):
+    sections = {}
+    for record in records:
+        try:
+            code = KIND_CODES[record['kind']]
+        except KeyError:
+            raise LevelFileError('no record type for %s' % record['kind'])
+        sections.setdefault(code, []).append(encodeRecord(code, record))
+
+    payload = []
+    for code in sorted(sections):
+        payload.append(SECTION.pack(code, len(sections[code])))
+        payload.extend(sections[code])
+    payload = ''.join(payload)
+
+    flags = 0
+    if compress:
+        payload = zlib.compress(payload, 9)
+        flags |= COMPRESSED
+
+    return HEADER.pack(MAGIC, VERSION, flags, len(sections)) + payload
+
+def write(filename, records, compress = True):
+    data = encode(records, compress)
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+# returns the records of the level, ordered by their ids
+def read(filename):
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    if len(data) < HEADER.size:
+        raise LevelFileError('%s: not a level file' % filename)
+    magic, version, flags, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise LevelFileError('%s: unsupported level file' % filename)
+
+    data = buffer(data, HEADER.size)
+    if flags & COMPRESSED:
+        data = zlib.decompress(data)
+
+    records = []
+    offset = 0
+    try:
+        for i in xrange(count):
+            code, n = SECTION.unpack_from(data, offset)
+            offset += SECTION.size
+            if code not in KINDS:
+                raise LevelFileError('%s: unknown record type %d'
+                        % (filename, code))
+            size = KINDS[code][2].size
+            for j in xrange(n):
+                records.append(decodeRecord(code, data, offset))
+                offset += size
+    except struct.error:
+        raise LevelFileError('%s: truncated level file' % filename)
+
+    records.sort(key = lambda record: record['id'])
+    return records
+
+
+# actors <-> records
+
+def actorRecord(actor):
+    record = {
+        'kind': type(actor).__name__,
+        'id': actor.id,
+        'static': actor.static,
+        'fixedRotation': actor.fixedRotation,
+        'position': (actor.position[0], actor.position[1]),
+        }
+    for f in COMMON_FIELDS:
+        record[f] = getattr(actor, f)
+    if hasattr(actor, 'size'): record['size'] = tuple(actor.size)
+    else: record['radius'] = actor.radius
+    return record
+
+# id -> actor dict of the given records, the actors have no bodies yet
+def createActors(records):
+    import objects # needs Box2D and pygame, the converter doesn't
+    actors = {}
+    for record in records:
+        kwargs = dict((f, record[f]) for f in COMMON_FIELDS)
+        kwargs['position'] = record['position']
+        kwargs['static'] = record['static']
+        kwargs['fixedRotation'] = record['fixedRotation']
+        if 'size' in record: kwargs['size'] = record['size']
+        else: kwargs['radius'] = record['radius']
+
+        cls = getattr(objects, record['kind'])
+        if cls is objects.Gorilla:
+            del kwargs['linearDamping'] # set by the gorilla
+        actor = cls(**kwargs)
+        actor.id = record['id']
+        actors[actor.id] = actor
+    return actors
+
+def actorRecords(actors):
+    return [actorRecord(actors[i]) for i in sorted(actors)]
+
+def save(filename, actors, compress = True):
+    write(filename, actorRecords(actors), compress)
+
+def load(filename):
+    return createActors(read(filename))
+
+
+# old levels (Level.dumpPickledData of the actors dict)
+
+class PickledObject_(object): pass
+
+# Unpickles only the objects found in level pickles: actors and b2Vec2s are
+# turned into plain PickledObject_ instances, nothing else is allowed
+class LevelUnpickler_(pickle.Unpickler):
+    def find_class(self, module, name):
+        if (module, name) == ('copy_reg', '_reconstructor'):
+            return copy_reg._reconstructor
+        if (module, name) == ('__builtin__', 'object'):
+            return object
+        if (module == 'objects' and name in KIND_CODES) or \
+                (module, name) == ('Box2D', 'b2Vec2'):
+            return type(name, (PickledObject_,), {})
+        raise pickle.UnpicklingError('%s.%s is not allowed in a level'
+                % (module, name))
+
+def readPickle(filename):
+    with open(filename, 'rb') as f:
+        actors = LevelUnpickler_(f).load()
+
+    records = []
+    for i in sorted(actors):
+        actor = actors[i]
+        record = {
+            'kind': type(actor).__name__,
+            'id': i,
+            'static': bool(actor.static),
+            'fixedRotation': bool(actor.fixedRotation),
+            'position': (actor.position.x, actor.position.y),
+            }
+        for f in COMMON_FIELDS:
+            record[f] = getattr(actor, f)
+        if hasattr(actor, 'size'): record['size'] = tuple(actor.size)
+        else: record['radius'] = actor.radius
+        records.append(record)
+    return records
+
+def convertPickle(src, dst, compress = True):
+    write(dst, readPickle(src), compress)
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) != 3:
+        print 'usage: python levelfile.py LEVEL.pickle LEVEL.tog'
+        sys.exit(2)
+    convertPickle(sys.argv[1], sys.argv[2])
@@ -3,37 +3,78 @@ import objects
 import math
 import utils
 import time
-import random
 from controls import Controls, CBInfo, TOGEvent, CTRL, ControlsCapsule
 import time
 import gravity_changers
-import pickle
+import levelfile
+import vecmath
+import tween
+import effects
+import snapshot
 
 class ContactType:
     add = 0
     persist = 1
     remove = 2
 
-# Box2D contact listener
-class ContactListener(b2d.b2ContactListener):
-    def __init__(self, level):
-        super(ContactListener, self).__init__()
-        self.level = level
+# Python version of Box2D's b2BufferedContactListener (see
+# Box2D_contactbuffer.i in the wrapper), used if the wrapper was built
+# without it. Contact points matching any of the rules are kept until
+# Flush() returns them as (type, userData1, userData2, x, y, velocity).
+class ContactBuffer(b2d.b2ContactListener):
+    def __init__(self):
+        super(ContactBuffer, self).__init__()
+        self.rules = []
+        self.events = []
+
+    def AddRule(self, typeMask, categoryBits1, categoryBits2, minVelocity):
+        self.rules.append((typeMask, categoryBits1, categoryBits2, minVelocity))
+
+    def ClearRules(self):
+        del self.rules[:]
+
+    def GetCount(self):
+        return len(self.events)
+
+    def Clear(self):
+        del self.events[:]
+
+    def Flush(self):
+        events = tuple(self.events)
+        del self.events[:]
+        return events
+
+    def record_(self, ctype, point):
+        c1 = point.shape1.GetFilterData().categoryBits
+        c2 = point.shape2.GetFilterData().categoryBits
+        velocity = point.velocity.Length()
+        for mask, cat1, cat2, minVelocity in self.rules:
+            if not mask & (1 << ctype) or velocity < minVelocity: continue
+            if (c1 & cat1 and c2 & cat2) or (c1 & cat2 and c2 & cat1):
+                self.events.append((ctype,
+                        point.shape1.GetBody().userData,
+                        point.shape2.GetBody().userData,
+                        point.position.x, point.position.y, velocity))
+                return
 
     def Add(self, point):
-        self.level.contactCallbacks(ContactType.add, point)
+        self.record_(ContactType.add, point)
 
     def Persist(self, point):
-        self.level.contactCallbacks(ContactType.persist, point)
+        self.record_(ContactType.persist, point)
 
     def Remove(self, point):
-        self.level.contactCallbacks(ContactType.remove, point)
+        self.record_(ContactType.remove, point)
 
+def newContactBuffer():
+    if hasattr(b2d, 'b2BufferedContactListener'):
+        return b2d.b2BufferedContactListener()
+    return ContactBuffer()
 
-# global function scheduler
-# maybe there's a better place for it then the module namespace
-G_FS = utils.FunsctionScheduler()
 
+# actors whose bodies move (see Level.saveTransforms)
+def isMoving(actor):
+    return not actor.static
 
 class Level(object):
     world = None
@@ -46,62 +87,93 @@ class Level(object):
     world_angle = None
     original_gravity = b2d.b2Vec2(0, -30)
     contactCallbackList = None
-    actors = {}
+    contacts = None # contact buffer of the world
+    effects = None # effects.EffectPool
+    history = None # snapshot.SnapshotRing
+    session = None
+    actors = None # registry.ActorRegistry of the session
+    sprites = None # actors without a body, id -> actor
+    candies = None
+    moving = None
     controls = None
-    actor_id_generator = (i for i in xrange(10**9))
     score = None
     toRemove = None
+    clock = None
+    scheduler = None
+    random = None
+    steps = 0 # world steps done so far
+    tweens = None
+    rotation_ = None
 
     def increaseScore(self):
         self.score+=1
 
     def timeLeft(self):
-        return round(max(0,self.worldEndsAt - time.time()), 1)
+        return round(max(0,self.worldEndsAt - self.clock.now()), 1)
 
     def getCenter(self):
         return b2d.b2Vec2(self.W, self.H)/2.
 
-    def getCameraPosition(self):
+    # 'alpha' tells how far the frame being drawn is between the previous and
+    # the current world step (see MaterialActor.renderTransform)
+    def getCameraPosition(self, alpha = 1.):
         return self.getCenter()
 
-    def getOriginalVec(self, *args):
-        vec = b2d.b2Vec2(*args)
-        return utils.rotate(vec, self.world_angle.get())
+    # rotation by the current world angle, shared by everything that
+    # converts vectors between the world and the view during a step / frame
+    def worldRotation(self):
+        angle = self.world_angle.get()
+        if self.rotation_ is None or self.rotation_.angle != angle:
+            self.rotation_ = vecmath.Rotation(angle)
+        return self.rotation_
+
+    # returns an (x, y) tuple
+    def getOriginalVec(self, x, y):
+        return self.worldRotation().apply(x, y)
 
     def getOriginalHorAngle(self):
-        a = b2d.b2Vec2(0,1)
-        b = self.getOriginalVec(a)
-        return -utils.angle_between(a,b)
+        return -vecmath.wrap_angle(self.world_angle.get())
 
     def changeGravityChanger(self, newChanger):
         if self.world_angle: self.world_angle.controls.unsubscribe()
         self.world_angle = newChanger
         self.world_angle.createControls()
 
-    def __init__(self, settings):
+    def __init__(self, session):
+        self.session = session
         self.toRemove = []
-        self.settings = settings
+        self.actors = session.actors
+        self.sprites = self.actors.index(objects.StaticSprite)
+        self.candies = self.actors.index(objects.Candy)
+        self.moving = self.actors.index(objects.MaterialActor, isMoving)
+        self.settings = session.settings
+        self.clock = session.clock
+        self.scheduler = session.scheduler
+        self.random = session.random
+        self.tweens = tween.TweenEngine(self.clock)
+        self.effects = effects.EffectPool(
+                self.clock,
+                objects.EFFECTS,
+                self.settings.effect_capacity,
+                self.settings.effect_cell,
+                self.settings.effect_interval)
+        self.history = snapshot.SnapshotRing(
+                self,
+                self.settings.snapshot_count,
+                int(round(self.settings.snapshot_interval /
+                    self.settings.time_step)))
         self.score = 0
-        self.worldEndsAt = time.time() + settings.time
-        self.contactCallbackList = {
-                ContactType.add: [],
-                ContactType.remove: [],
-                ContactType.persist: [],
-                }
+        self.worldEndsAt = self.clock.now() + self.settings.time
+        self.contactCallbackList = []
 
-        self.subscribeToContacts(ContactType.add, self.clash)
-        self.changeGravityChanger(gravity_changers.ConstantGravity())
+        self.subscribeToContacts(self.clash)
+        self.changeGravityChanger(gravity_changers.ConstantGravity(self))
 
     def addActor(self, actor):
-        actor.id = 0
-        while actor.id in self.actors.keys():
-            actor.id = self.actor_id_generator.next()
-
-        self.actors[actor.id] = actor
-        return actor.id
+        return self.actors.add(actor)
 
     def removeActor(self, actor):
-        self.actors.pop(actor.id)
+        self.actors.remove(actor)
         self.toRemove.append(actor)
 
     # returns an arbitrary actor that contains the given point
@@ -132,9 +204,11 @@ class Level(object):
 
         res = None
         res_dist = 10e20
+        candies = self.candies
         for shape in shapes:
             actor = shape.GetBody().userData
-            if not isinstance(actor, objects.Candy): continue
+            # bodies of removed candies live until the end of the world step
+            if candies.get(actor.id) is not actor: continue
             dist = (actor.body.position - pos).Length()
             if res_dist > dist:
                 res = actor
@@ -142,34 +216,163 @@ class Level(object):
         return res
 
     def createControls(self):
-        self.controls = ControlsCapsule()
+        self.controls = ControlsCapsule(self.session.controls)
 
     def physicsStep_(self):
-        gravity = utils.rotate(self.original_gravity, self.world_angle.get())
-        self.world.SetGravity(gravity)
+        g = self.original_gravity
+        self.world.SetGravity(self.worldRotation().apply(g.x, g.y))
         self.world.Step(
                 self.settings.time_step,
                 self.settings.vel_iters,
                 self.settings.pos_iters)
 
+    # remembers the transforms of the moving bodies, so that frames drawn
+    # between two world steps can be interpolated
+    def saveTransforms(self):
+        for actor in self.moving.itervalues():
+            if actor.body is not None:
+                actor.saveTransform()
+
+    # True if the simulation blew up (a moving body is at NaN or infinity)
+    def diverged(self):
+        for actor in self.moving.itervalues():
+            body = actor.body
+            if body is None: continue
+            p = body.position
+            if math.isnan(p.x) or math.isnan(p.y) or \
+                    math.isinf(p.x) or math.isinf(p.y):
+                return True
+        return False
+
     def updateWorld(self):
+        self.saveTransforms()
         if self.timeLeft() <= 0:
             return
-
-        G_FS.work()
-        self.world_angle.step()
-        self.physicsStep_()
+        self.history.update()
+
+        # the clock tells the time at the end of the step being simulated
+        self.clock.advance(self.settings.time_step)
+        self.steps += 1
+        timer = self.session.timer
+        with timer.phase('scheduler'):
+            self.scheduler.work()
+        self.effects.sweep()
+        self.tweens.step()
+        with timer.phase('physicsStep'):
+            self.physicsStep_()
+        with timer.phase('contacts'):
+            self.contactCallbacks(self.contacts.Flush())
         #print self.world_angle.get()
         for actor in self.toRemove:
             actor.cleanUp()
         del self.toRemove[:]
     
-    def subscribeToContacts(self, ctype, cb):
-        self.contactCallbackList[ctype].append(cb)
+    # the state of the level between two world steps (see snapshot.py)
+    def snapshot(self):
+        snap = snapshot.LevelSnapshot()
+        snap.steps = self.steps
+        snap.time = self.clock.now()
+        snap.actors = self.actors.snapshot()
+
+        snap.bodies = []
+        for actor in self.moving.itervalues():
+            body = actor.body
+            if body is None: continue
+            p = body.position
+            v = body.linearVelocity
+            snap.bodies.append((actor, p.x, p.y, body.angle,
+                    v.x, v.y, body.angularVelocity))
+
+        snap.states = []
+        for actor in self.actors.itervalues():
+            state = actor.snapshot()
+            if state is not None:
+                snap.states.append((actor, state))
+
+        snap.score = self.score
+        snap.worldEndsAt = self.worldEndsAt
+        snap.random = self.random.getstate()
+        snap.scheduler = self.scheduler.snapshot()
+        snap.tweens = self.tweens.snapshot()
+        snap.effects = self.effects.snapshot()
+        snap.gravity = self.world_angle.snapshot()
+        return snap
+
+    # Box2D's contact caches are not a part of the snapshot, the contacts
+    # of the moving bodies are dropped and found again by the next step
+    def restore(self, snap):
+        current = self.actors.values()
+        self.actors.restore(snap.actors)
+
+        # actors removed since the snapshot was taken
+        for actor in self.actors.itervalues():
+            if actor.body is None and \
+                    isinstance(actor, objects.MaterialActor):
+                actor.create(self)
 
-    def contactCallbacks(self, ctype, point):
-        for cb in self.contactCallbackList[ctype]:
-            cb(point)
+        # Box2D freezes a body that went NaN or left the world and SetXForm
+        # doesn't move it anymore: such bodies are created again (their
+        # joints go with them, the states below make them again)
+        frozen = [entry[0] for entry in snap.bodies
+                if entry[0].body.IsFrozen()]
+        if frozen:
+            for actor in self.actors.itervalues():
+                actor.releaseJoints()
+            for actor in frozen:
+                actor.destroy()
+                actor.create(self)
+
+        for actor, x, y, angle, vx, vy, w in snap.bodies:
+            body = actor.body
+            body.SetXForm((x, y), angle)
+            body.SetLinearVelocity((vx, vy))
+            body.SetAngularVelocity(w)
+            body.WakeUp()
+            for shape in body.shapeList:
+                self.world.Refilter(shape)
+            actor.previous = (x, y, angle)
+
+        for actor, state in snap.states:
+            actor.restore(state)
+
+        # actors added since the snapshot was taken
+        for actor in current:
+            if self.actors.get(actor.id) is not actor:
+                actor.cleanUp()
+        del self.toRemove[:]
+
+        self.steps = snap.steps
+        self.clock.time = snap.time
+        self.score = snap.score
+        self.worldEndsAt = snap.worldEndsAt
+        self.random.setstate(snap.random)
+        self.scheduler.restore(snap.scheduler)
+        self.tweens.restore(snap.tweens)
+        self.effects.restore(snap.effects)
+        self.world_angle.restore(snap.gravity)
+        self.rotation_ = None
+
+    # 'cb' gets the contact points buffered during a world step (see
+    # contactRules), once per step
+    def subscribeToContacts(self, cb):
+        self.contactCallbackList.append(cb)
+
+    def contactCallbacks(self, events):
+        if not events: return
+        for cb in self.contactCallbackList:
+            cb(events)
+
+    # (typeMask, categoryBits1, categoryBits2, minVelocity) rules of the
+    # contact points that are buffered, the filtering is done by Box2D
+    def contactRules(self):
+        add = 1 << ContactType.add
+        Category = objects.Category
+        return [
+            # clashes strong enough for a "POW!"
+            (add, Category.all, Category.all, self.settings.clash_velocity),
+            # candies brought to the hut
+            (add, Category.hut, Category.candy, 0),
+            ]
 
     def constructFrame(self):
         frame = [
@@ -206,60 +409,68 @@ class Level(object):
         worldAABB.upperBound = (self.size[0]+20, self.size[1]+20)
         self.world = b2d.b2World(worldAABB, self.original_gravity, doSleep)
 
-        self.contactListener = ContactListener(self)
-        self.world.SetContactListener(self.contactListener)
+        self.contacts = newContactBuffer()
+        for rule in self.contactRules():
+            self.contacts.AddRule(*rule)
+        self.world.SetContactListener(self.contacts)
+
+    # destroys the bodies of the actors and the world. The bodies hold
+    # references to their actors, a level is kept alive by them until it's
+    # destroyed.
+    def destroy(self):
+        if self.world is None: return
+        for actor in self.actors.values():
+            actor.releaseJoints()
+        # removed actors keep their bodies until the end of the world step
+        for actor in self.actors.values() + self.toRemove:
+            if isinstance(actor, objects.MaterialActor) and \
+                    actor.body is not None:
+                actor.destroy()
+        del self.toRemove[:]
+        self.world.SetContactListener(None)
+        self.world = None
+        self.contacts = None
 
-    def putStaticActor(self, actor, removeAfter = 0.5):
-        self.addActor(actor)
-        G_FS.addAction(
-            fun = lambda: self.removeActor(actor),
-            delay = removeAfter)
+    # shows an effect (objects.Effect subclass) for 'lifetime' seconds
+    def putEffect(self, cls, position, lifetime = 0.5):
+        return self.effects.spawn(cls, position, lifetime, self.random)
 
 
     # displays "POW!" actor when the main character collides with an obstacle
-    def clash(self, point):
-        o1 = point.shape1.GetBody().userData
-        o2 = point.shape2.GetBody().userData
-        pos = point.position.copy()
-
-        if o1.clashWith(o2, pos): return
-        if o2.clashWith(o1, pos): return
-
-        if point.velocity.Length()<10: return
-        actor = random.choice((objects.Pow1, objects.Pow2))(pos)
-        self.putStaticActor(actor, 0.2)
-
-    # pickling
-    def loadPickledData(self, filename = 'pickle.data'):
-        print 'LOAD'
-        with open(filename, 'rb') as f:
-            self.actors = pickle.load(f)
-
-            for actor in self.actors.values():
-                print actor
-                actor.create(self)
-
-                if isinstance(actor, objects.Gorilla):
-                    self.character = actor
-
-                if isinstance(actor, objects.GorillaHut):
-                    self.gorilla_hut = actor
-
-    def dumpPickledData(self, filename = 'pickle.data'):
-        print 'DUMP'
-        with open(filename, 'w') as f:
-            # we don't want to pickle the whole b2 world
-            for actor in self.actors.values():
-                actor.destroy()
-
-            try:
-                pickle.dump(self.actors, f)
-            except Exception, s:
-                print 'Pickling failed: ', s
-                return
-
-            for actor in self.actors.values():
-                actor.create(self)
+    def clash(self, events):
+        actors = self.actors
+        for ctype, o1, o2, x, y, velocity in events:
+            if ctype != ContactType.add: continue
+            # e.g. a candy that touched the hut at two points
+            if actors.get(o1.id) is not o1 or actors.get(o2.id) is not o2:
+                continue
+            pos = b2d.b2Vec2(x, y)
+
+            if o1.clashWith(o2, pos): continue
+            if o2.clashWith(o1, pos): continue
+
+            if velocity < self.settings.clash_velocity: continue
+            cls = self.random.choice((objects.Pow1, objects.Pow2))
+            self.putEffect(cls, pos, 0.2)
+
+    # loads a level file (see levelfile.py) or a pickled level saved by the
+    # older versions
+    def loadData(self, filename = 'level.tog'):
+        if levelfile.isLevelFile(filename):
+            records = levelfile.read(filename)
+        else:
+            records = levelfile.readPickle(filename)
+
+        # the registry is shared with the session, it's updated in place
+        self.actors.load(levelfile.createActors(records))
+        for actor in self.actors.values():
+            actor.create(self)
+
+        self.character = self.actors.first(objects.Gorilla)
+        self.gorilla_hut = self.actors.first(objects.GorillaHut)
+
+    def dumpData(self, filename = 'level.tog'):
+        levelfile.save(filename, self.actors)
 
 class PickledLevel(Level):
     filename = None
@@ -268,17 +479,24 @@ class PickledLevel(Level):
         super(PickledLevel, self).__init__(*args, **kwargs)
         self.filename = filename
 
-        wa = gravity_changers.GravityChanger()
-        #wa = gravity_changers.ContinuousGravityChanger()
+        wa = gravity_changers.GravityChanger(self)
+        #wa = gravity_changers.ContinuousGravityChanger(self)
         self.changeGravityChanger(wa)
 
     def constructWorld(self):
         super(PickledLevel, self).constructWorld()
-        self.loadPickledData(self.filename)
+        self.loadData(self.filename)
 
     def createControls(self):
         super(PickledLevel, self).createControls()
         self.character.createControls()
 
-    def getCameraPosition(self):
-        return self.character.body.position
+        self.controls.addCallback(CBInfo(
+                TOGEvent(code = CTRL.RETRY),
+                cb = self.history.retry))
+        self.controls.addCallback(CBInfo(
+                TOGEvent(code = CTRL.REWIND),
+                cb = self.history.rewind))
+
+    def getCameraPosition(self, alpha = 1.):
+        return self.character.renderTransform(alpha)[0]
@@ -1,12 +1,13 @@
 import Box2D as b2d
-import pygame.image
 import utils
+import vecmath
 import math
-import random
-import levels
 from controls import Controls, CBInfo, TOGEvent, CTRL, ControlsCapsule
 
 class Actor(object):
+    # Box2D body of the actor, None for actors that are only drawn
+    body = None
+
     def draw(self, graphics): raise NotImplementedError
 
     def isMainCharacter(self):
@@ -18,12 +19,24 @@ class Actor(object):
     def move(self, vec): raise NotImplementedError
     def isPointInside(self, vec): raise NotImplementedError
 
+    # pre-renders the sprites used by the actor (see Graphics.warmUp)
+    def warmUp(self, graphics): pass
+
     # called after the actor is removed from the level
     def cleanUp(self): pass
 
     # returns true if event should be consumed
     def clashWith(self, actor2, pos): return False
 
+    # state of the actor not kept by its body, or None (see Level.snapshot);
+    # restore is called once the bodies of the level are restored
+    def snapshot(self): return None
+    def restore(self, state): pass
+
+    # destroys the joints the actor made, before bodies are destroyed by
+    # Level.restore (restore makes them again)
+    def releaseJoints(self): pass
+
 
 class StaticSprite(Actor):
     def __init__(self, position, size, spr_name, angle = 0):
@@ -40,37 +53,83 @@ class StaticSprite(Actor):
         self.position += vec
 
 
-class Pow1(StaticSprite):
-    def __init__(self, position, size=(3,3)):
-        angle = random.randint(-40, 40)
-        super(Pow1, self).__init__(position, size, './sprites/pow1.png', angle)
-
-class Scored(StaticSprite):
-    def __init__(self, position, size=(6,6)):
-        angle = random.randint(-40, 40)
-        super(Scored, self).__init__(position, size, './sprites/scored.png', angle)
+# sprites of the effects are rotated by a random angle from this range
+# ('rng' of the effects should be the random generator of the session)
+EFFECT_ANGLES = range(-40, 41)
 
+# A short-lived sprite, e.g. "POW!". Effects are not actors of the level,
+# they are reused by an effects.EffectPool, which calls reset() every time
+# the effect is shown again.
+class Effect(StaticSprite):
+    spr_name = None
+    size = None
+    # at most one effect of a group is shown per cell and interval
+    # (see effects.EffectPool), None - no limit
+    group = None
 
-class Pow2(StaticSprite):
-    def __init__(self, position, size=(3,3)):
-        angle = random.randint(-40, 40)
-        super(Pow2, self).__init__(position, size, './sprites/pow2.png', angle)
+    def __init__(self):
+        super(Effect, self).__init__(None, self.size, self.spr_name)
 
-class SaySomething(StaticSprite):
-    def __init__(self, position, size=(4,4)):
-        angle = random.randint(-40, 40)
-        sprite = random.choice((
-            './sprites/say1.png',
-            './sprites/say2.png',
-            './sprites/say3.png',
-            './sprites/say4.png',
-            './sprites/say5.png',
-            ))
-        super(SaySomething, self).__init__(position, size, sprite, angle)
+    def reset(self, position, rng):
+        self.position = position
+        self.angle = rng.choice(EFFECT_ANGLES)
+
+    # sprites that the effect may show
+    @classmethod
+    def allSprites(cls):
+        return (cls.spr_name,)
+
+class Pow1(Effect):
+    spr_name = './sprites/pow1.png'
+    size = (3,3)
+    group = 'pow'
+
+class Pow2(Effect):
+    spr_name = './sprites/pow2.png'
+    size = (3,3)
+    group = 'pow'
+
+class Scored(Effect):
+    spr_name = './sprites/scored.png'
+    size = (6,6)
+
+class SaySomething(Effect):
+    size = (4,4)
+    sprites = (
+        './sprites/say1.png',
+        './sprites/say2.png',
+        './sprites/say3.png',
+        './sprites/say4.png',
+        './sprites/say5.png',
+        )
+
+    def reset(self, position, rng):
+        super(SaySomething, self).reset(position, rng)
+        self.spr_name = rng.choice(self.sprites)
+
+    @classmethod
+    def allSprites(cls):
+        return cls.sprites
+
+EFFECTS = (Pow1, Pow2, Scored, SaySomething)
+
+def warmUpEffects(graphics):
+    for cls in EFFECTS:
+        for spr_name in cls.allSprites():
+            graphics.warmUpSprite(spr_name, cls.size, EFFECT_ANGLES)
+
+# collision categories of the shapes (b2FilterData.categoryBits), the
+# contact points are filtered by them (see Level.contactRules)
+class Category:
+    default = 0x0001
+    candy = 0x0002
+    hut = 0x0004
+    all = 0xFFFF
 
 class MaterialActor(Actor):
     body = None
     level = None
+    category = Category.default
 
     #body
     position = None
@@ -83,6 +142,9 @@ class MaterialActor(Actor):
     #shape
     density = None
 
+    # (x, y, angle) of the body before the last world step
+    previous = None
+
     def __init__(self,
             position = None,
             density = 1.,
@@ -112,6 +174,7 @@ class MaterialActor(Actor):
         self.body = None
         self.world = None
         self.level = None
+        self.previous = None
 
     def createBody(self):
         bodyDef = b2d.b2BodyDef()
@@ -124,9 +187,27 @@ class MaterialActor(Actor):
         self.body = self.world.CreateBody(bodyDef)
         self.body.SetUserData(self)
 
+    def saveTransform(self):
+        p = self.body.position
+        self.previous = (p.x, p.y, self.body.angle)
+
+    # the body's position and angle interpolated between the previous
+    # and the current world step (alpha = 0 .. 1)
+    def renderTransform(self, alpha):
+        p = self.body.position
+        angle = self.body.angle
+        if self.previous is None or alpha >= 1:
+            return (p.x, p.y), angle
+
+        x,y,a = self.previous
+        return ((x + (p.x-x)*alpha, y + (p.y-y)*alpha),
+                a + (angle-a)*alpha)
+
     def poke(self, vec):
-        massCenter = self.body.massData.center
-        self.body.ApplyImpulse(vec, massCenter)
+        # massData is a temporary copy, 'center' points into it and must
+        # not outlive it
+        massData = self.body.massData
+        self.body.ApplyImpulse(vec, massData.center)
 
     def move(self, vec):
         self.position += vec
@@ -157,6 +238,7 @@ class Ball(MaterialActor):
         shapeDef.density = self.density
         shapeDef.restitution = self.restitution
         shapeDef.radius = self.radius
+        shapeDef.filter.categoryBits = self.category
 
         shape = self.body.CreateShape(shapeDef)
 
@@ -167,7 +249,8 @@ class Ball(MaterialActor):
         color = (130,40,120)
         if self.static: 
             color = (100, 20, 100)
-        graphics.circle(color, self.body.position, self.radius)
+        position, angle = self.renderTransform(graphics.alpha)
+        graphics.circle(color, position, self.radius)
 
     #rotating a ball is easy
     def rotate(self, vec1, vec2): pass
@@ -185,6 +268,7 @@ class Ball(MaterialActor):
 
 class Box(MaterialActor):
     size = None
+    vertices = None # body-local, cached by draw
 
     def __init__(self, size, **kwargs):
         super(Box, self).__init__(**kwargs)
@@ -193,18 +277,24 @@ class Box(MaterialActor):
 
     def create(self, level):
         super(Box, self).create(level)
+        self.vertices = None
 
         shapeDef = b2d.b2PolygonDef()
         shapeDef.SetAsBox(*self.size)
 
         shapeDef.density = self.density #XXX
         shapeDef.restitution = self.restitution
+        shapeDef.filter.categoryBits = self.category
 
         self.body.CreateShape(shapeDef)
 
         if not self.static:
             self.body.SetMassFromShapes()
 
+    def destroy(self):
+        super(Box, self).destroy()
+        self.vertices = None
+
     def resize(self, vec1, vec2):
         level = self.level
         self.destroy()
@@ -235,20 +325,28 @@ class Box(MaterialActor):
         self.create(level)
 
     def draw(self, graphics):
-        shape = self.body.GetShapeList()[0]
-        points = map(self.body.GetWorldPoint, shape.getVertices_tuple())
-        graphics.polygon((200,10,100), points)
+        if self.vertices is None:
+            self.vertices = self.body.GetShapeList()[0].getVertices_tuple()
+        position, angle = self.renderTransform(graphics.alpha)
+        graphics.bodyPolygon((200,10,100), self.vertices, position, angle)
 
 class Candy(Ball):
     spr_name = './sprites/candy.png'
+    category = Category.candy
     grabbed = False
 
+    def warmUp(self, graphics):
+        graphics.warmUpSprite(
+                self.spr_name,
+                (self.radius, 4./3.*self.radius))
+
     def draw(self, graphics):
+        position, angle = self.renderTransform(graphics.alpha)
         graphics.putSprite(
-                self.body.position,
+                position,
                 self.spr_name,
                 (self.radius, 4./3.*self.radius),
-                angle=self.body.angle*180/math.pi)
+                angle=angle*180/math.pi)
 
     def rotate(self, vec1, vec2):
         level = self.level
@@ -268,13 +366,25 @@ class Candy(Ball):
     def canStoreInTheHut(self):
         return not self.grabbed
 
+    def snapshot(self):
+        return self.grabbed
+
+    def restore(self, grabbed):
+        self.grabbed = grabbed
+
 class GorillaHut(Box):
     spr_name = './sprites/gorilla_hut.png'
+    category = Category.hut
+
+    # the hut is usually seen in one of the four resting world angles
+    def warmUp(self, graphics):
+        w,h = self.size
+        graphics.warmUpSprite(self.spr_name, (w*1.3, h*1.3), (0, 90, 180, 270))
 
     def draw(self, graphics):
         w,h = self.size
         graphics.putSprite(
-                self.body.position,
+                self.renderTransform(graphics.alpha)[0],
                 self.spr_name,
                 (w*1.3, h*1.3),
                 angle = self.level.getOriginalHorAngle()*180/math.pi)
@@ -283,10 +393,9 @@ class GorillaHut(Box):
         if type(actor2) != Candy: return False
 
         if actor2.canStoreInTheHut():
-            print 'jazda z ', actor2
             self.level.removeActor(actor2)
             self.level.increaseScore()
-            self.level.putStaticActor(Scored(pos), 0.2)
+            self.level.putEffect(Scored, pos, 0.2)
             return True
         else:
             return False
@@ -298,6 +407,8 @@ class Gorilla(Ball):
     happy_spr_name = './sprites/happy_monkey.png'
     grab_spr_name = './sprites/grab.png'
     candy = None
+    # ContinuousActions created by createControls
+    moveUp = moveDown = moveLeft = moveRight = None
 
     def __init__(self, **kwargs):
         kwargs['linearDamping'] = 0.7
@@ -309,13 +420,14 @@ class Gorilla(Ball):
     def drawHand(self, graphics):
         if not self.grabJoint: return
 
-        a = self.grabJoint.GetAnchor1()
-        b = self.grabJoint.GetAnchor2()
-        pos = (a+b)/2.
-        h = (a-b).Length()/2.
+        # both anchors are placed in the centers of the bodies
+        ax,ay = self.renderTransform(graphics.alpha)[0]
+        bx,by = self.candy.renderTransform(graphics.alpha)[0]
+        pos = ((ax+bx)/2., (ay+by)/2.)
+        h = vecmath.length(bx-ax, by-ay)/2.
         w = h/4.
-        right = utils.rotate(b2d.b2Vec2(-10,0), self.level.world_angle.get())
-        angle = utils.angle_between(right, b-a)*180/math.pi-90
+        rx,ry = self.level.worldRotation().apply(-10, 0)
+        angle = vecmath.angle_between(rx, ry, bx-ax, by-ay)*180/math.pi-90
 
         graphics.putSprite(
                 pos,
@@ -325,17 +437,19 @@ class Gorilla(Ball):
 
     def draw(self, graphics):
         #super(Gorilla, self).draw(graphics)
-        right = utils.rotate(b2d.b2Vec2(-10,0), self.level.world_angle.get())
-        if self.body.linearVelocity.Length()<1:
+        rx,ry = self.level.worldRotation().apply(-10, 0)
+        v = self.body.linearVelocity
+        vx,vy = v.x, v.y
+        if vecmath.length(vx, vy)<1:
             angle = 0.
         else:
-            angle = utils.angle_between(right, self.body.linearVelocity-right)
+            angle = vecmath.angle_between(rx, ry, vx-rx, vy-ry)
             angle = int(angle * 180 / math.pi)
 
         if self.hasCandy(): sprite = self.happy_spr_name
         else: sprite = self.spr_name
         graphics.putSprite(
-                self.body.position,
+                self.renderTransform(graphics.alpha)[0],
                 sprite,
                 (self.radius, self.radius),
                 angle=angle,
@@ -354,7 +468,9 @@ class Gorilla(Ball):
 
         self.candy = candy
         self.candy.grab()
+        self.attach_(candy)
 
+    def attach_(self, candy):
         djd = b2d.b2DistanceJointDef()
         djd.body1 = self.body
         djd.body2 = candy.body
@@ -369,10 +485,10 @@ class Gorilla(Ball):
             self.level.world.DestroyJoint(self.grabJoint)
             self.grabJoint = None
 
-            offs = b2d.b2Vec2(self.radius*1.5, self.radius*1.5)
-            offs = utils.rotate(offs, self.level.world_angle.get())
-            saypos = self.body.position + offs
-            self.level.putStaticActor(SaySomething(saypos), removeAfter = 1)
+            ox,oy = self.level.getOriginalVec(self.radius*1.5, self.radius*1.5)
+            p = self.body.position
+            saypos = b2d.b2Vec2(p.x + ox, p.y + oy)
+            self.level.putEffect(SaySomething, saypos, 1)
 
             self.candy.release()
             self.candy = None
@@ -381,21 +497,42 @@ class Gorilla(Ball):
     def isMainCharacter(self):
         return True
 
+    def moves_(self):
+        return (self.moveUp, self.moveDown, self.moveLeft, self.moveRight)
+
+    def snapshot(self):
+        return (self.candy,
+                [a and a.snapshot() for a in self.moves_()])
+
+    def releaseJoints(self):
+        if self.grabJoint:
+            self.level.world.DestroyJoint(self.grabJoint)
+            self.grabJoint = None
+
+    def restore(self, (candy, moves)):
+        self.releaseJoints()
+        self.candy = candy
+        if candy is not None:
+            self.attach_(candy)
+
+        for action, state in zip(self.moves_(), moves):
+            if action: action.restore(state)
+
 
     def createControls(self):
-        self.controls = ControlsCapsule()
+        self.controls = ControlsCapsule(self.level.session.controls)
 
         # create ContinuousActions that will move the main character
-        self.moveUp = utils.ContinuousAction(levels.G_FS,
+        self.moveUp = utils.ContinuousAction(self.level.scheduler,
                 fun = lambda: self.poke(self.level.getOriginalVec(0,340)),
                 interval = 0.02)
-        self.moveDown = utils.ContinuousAction(levels.G_FS,
+        self.moveDown = utils.ContinuousAction(self.level.scheduler,
                 fun = lambda: self.poke(self.level.getOriginalVec(0,-240)),
                 interval = 0.02)
-        self.moveLeft = utils.ContinuousAction(levels.G_FS,
+        self.moveLeft = utils.ContinuousAction(self.level.scheduler,
                 fun = lambda: self.poke(self.level.getOriginalVec(-300,0)),
                 interval = 0.02)
-        self.moveRight = utils.ContinuousAction(levels.G_FS,
+        self.moveRight = utils.ContinuousAction(self.level.scheduler,
                 fun = lambda: self.poke(self.level.getOriginalVec(300,0)),
                 interval = 0.02)
 
@@ -0,0 +1,119 @@
+from collections import OrderedDict
+
+# Actors of a level, id -> actor.
+# Ids are given out by a counter, so adding and removing an actor is O(1) and
+# the iteration order (insertion order) is the order of the ids, which is
+# also the drawing order.
+#
+# Secondary indexes hold the actors of a class (optionally filtered with
+# 'where', which is evaluated once, when the actor is added), e.g.
+#
+#   candies = registry.index(objects.Candy)
+#   moving = registry.index(objects.MaterialActor, lambda a: not a.static)
+#
+# An index is a live id -> actor OrderedDict kept in the same order as the
+# registry. The indexes an actor belongs to are computed once per type.
+class ActorRegistry(object):
+    def __init__(self):
+        self.actors = OrderedDict()
+        self.next_id = 0
+        self.indexes = OrderedDict() # (cls, where) -> OrderedDict
+        self.memberships = {} # type -> [(where, index)]
+
+    def index(self, cls, where = None):
+        key = (cls, where)
+        try:
+            return self.indexes[key]
+        except KeyError:
+            pass
+        index = self.indexes[key] = OrderedDict()
+        for actor in self.actors.itervalues():
+            if isinstance(actor, cls) and (where is None or where(actor)):
+                index[actor.id] = actor
+        self.memberships.clear()
+        return index
+
+    def membership_(self, actor):
+        t = type(actor)
+        try:
+            return self.memberships[t]
+        except KeyError:
+            m = self.memberships[t] = [(where, index)
+                    for (cls, where), index in self.indexes.iteritems()
+                    if issubclass(t, cls)]
+            return m
+
+    def insert_(self, actor):
+        self.actors[actor.id] = actor
+        for where, index in self.membership_(actor):
+            if where is None or where(actor):
+                index[actor.id] = actor
+
+    # gives the actor a new id and returns it
+    def add(self, actor):
+        actor.id = self.next_id
+        self.next_id += 1
+        self.insert_(actor)
+        return actor.id
+
+    def remove(self, actor):
+        del self.actors[actor.id]
+        for where, index in self.membership_(actor):
+            index.pop(actor.id, None)
+
+    # replaces the content of the registry with the given id -> actor
+    # dict (e.g. a loaded level), the actors keep their ids
+    def load(self, actors):
+        self.clear()
+        for i in sorted(actors):
+            actor = actors[i]
+            actor.id = i
+            self.insert_(actor)
+        if actors:
+            self.next_id = max(actors) + 1
+
+    # the actors and the id counter (see restore)
+    def snapshot(self):
+        return (self.actors.values(), self.next_id)
+
+    def restore(self, (actors, next_id)):
+        self.clear()
+        for actor in actors:
+            self.insert_(actor)
+        self.next_id = next_id
+
+    def clear(self):
+        self.actors.clear()
+        self.next_id = 0
+        for index in self.indexes.itervalues():
+            index.clear()
+
+    # the first actor of the given class (in id order) or None
+    def first(self, cls):
+        for actor in self.index(cls).itervalues():
+            return actor
+
+    # plain id -> actor dict, e.g. for pickling
+    def asDict(self):
+        return dict(self.actors)
+
+    def get(self, id, default = None):
+        return self.actors.get(id, default)
+
+    def values(self):
+        return self.actors.values()
+
+    def itervalues(self):
+        return self.actors.itervalues()
+
+    def __getitem__(self, id):
+        return self.actors[id]
+
+    def __contains__(self, id):
+        return id in self.actors
+
+    def __iter__(self):
+        return iter(self.actors)
+
+    def __len__(self):
+        return len(self.actors)
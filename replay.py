@@ -0,0 +1,145 @@
+import struct
+import Box2D as b2d
+from controls import TOGEvent, CTRL
+
+# Input logs: the stream of TOGEvents dispatched during a session, keyed by
+# the number of world steps done before the event (not by wall time), plus
+# the seed of the session's random generator. Replaying a log into a level
+# constructed the same way reproduces the session exactly.
+#
+# File layout (little endian):
+#   header: magic 'TOGR', version (uint16), seed (uint32)
+#   record: step (uint32), code (uint16), pressed (int8: 1, 0, -1 = None),
+#           world position x, y (float64, NaN if the event has none)
+
+MAGIC = 'TOGR'
+VERSION = 1
+HEADER = struct.Struct('<4sHI')
+RECORD = struct.Struct('<IHbdd')
+NAN = float('nan')
+
+class InputLogError(Exception): pass
+
+def encodePressed(pressed):
+    if pressed is None: return -1
+    return int(bool(pressed))
+
+def decodePressed(value):
+    if value < 0: return None
+    return bool(value)
+
+
+# Appends every event dispatched by a controls bus to a log file
+# (see Controls.recorder)
+class InputRecorder:
+    def __init__(self, filename, level, seed):
+        self.level = level
+        self.f = open(filename, 'wb')
+        self.f.write(HEADER.pack(MAGIC, VERSION, seed))
+
+    def record(self, togEvent):
+        pos = togEvent.position
+        if pos is None: x, y = NAN, NAN
+        else: x, y = pos[0], pos[1]
+        self.f.write(RECORD.pack(self.level.steps, togEvent.code,
+                encodePressed(togEvent.pressed), x, y))
+
+    def close(self):
+        self.f.close()
+
+
+class InputLog:
+    def __init__(self, seed, records):
+        self.seed = seed
+        self.records = records # (step, code, pressed, position) tuples
+
+    @staticmethod
+    def load(filename):
+        with open(filename, 'rb') as f:
+            data = f.read()
+
+        if len(data) < HEADER.size:
+            raise InputLogError('%s: not an input log' % filename)
+        magic, version, seed = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise InputLogError('%s: unsupported input log' % filename)
+
+        records = []
+        for offset in xrange(HEADER.size, len(data) - RECORD.size + 1,
+                RECORD.size):
+            step, code, pressed, x, y = RECORD.unpack_from(data, offset)
+            position = None
+            if x == x: position = b2d.b2Vec2(x, y) # NaN != NaN
+            records.append((step, code, decodePressed(pressed), position))
+        return InputLog(seed, records)
+
+
+# Scripted input, a text file with an event per line:
+#   STEP CODE [down | up | any] [X Y]
+# e.g. '120 GRAB down'. CODE is a name of a controls.CTRL code, the event is
+# a press if the state is omitted. Empty lines and lines starting with '#'
+# are skipped, except for a '# seed N' line giving the seed of the log.
+PRESSED = {'down': True, 'up': False, 'any': None}
+
+def parseScript(filename):
+    seed = None
+    records = []
+    with open(filename) as f:
+        for lineNo, line in enumerate(f, 1):
+            fields = line.split()
+            if fields[:2] == ['#', 'seed'] and len(fields) == 3:
+                seed = int(fields[2])
+            if not fields or fields[0].startswith('#'): continue
+            try:
+                step = int(fields[0])
+                code = getattr(CTRL, fields[1])
+                pressed = True
+                rest = fields[2:]
+                if rest and rest[0] in PRESSED:
+                    pressed = PRESSED[rest.pop(0)]
+                position = None
+                if rest:
+                    x, y = rest
+                    position = b2d.b2Vec2(float(x), float(y))
+            except (ValueError, IndexError, AttributeError):
+                raise InputLogError('%s:%d: bad event %r'
+                        % (filename, lineNo, line.strip()))
+            records.append((step, code, pressed, position))
+
+    records.sort(key = lambda record: record[0])
+    return InputLog(seed, records)
+
+# writes the records of 'log' as an input script, the seed as a comment
+def writeScript(filename, log):
+    names = dict((code, name) for name, code in vars(CTRL).items())
+    states = dict((pressed, state) for state, pressed in PRESSED.items())
+    with open(filename, 'w') as f:
+        if log.seed is not None:
+            f.write('# seed %d\n' % log.seed)
+        for step, code, pressed, position in log.records:
+            line = '%d %s %s' % (step, names[code], states[pressed])
+            if position is not None:
+                line += ' %r %r' % (position[0], position[1])
+            f.write(line + '\n')
+
+
+# Feeds a recorded log back through a controls bus, without pygame.
+# 'dispatchDue' should be called right before every Level.updateWorld.
+class InputReplay:
+    def __init__(self, log, controls, level):
+        self.log = log
+        self.controls = controls
+        self.level = level
+        self.next = 0
+
+    def dispatchDue(self):
+        records = self.log.records
+        while self.next < len(records) and \
+                records[self.next][0] <= self.level.steps:
+            step, code, pressed, position = records[self.next]
+            self.next += 1
+            self.controls.dispatchEvent_(TOGEvent(
+                code, position = position, pressed = pressed))
+
+    def done(self):
+        return self.next >= len(self.log.records)
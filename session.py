@@ -0,0 +1,35 @@
+import random
+import utils
+import frame_timing
+import registry
+from controls import Controls
+
+def newScheduler(settings, clock):
+    if settings.scheduler == 'wheel':
+        return utils.TimerWheelScheduler(clock)
+    return utils.FunsctionScheduler(clock)
+
+# The context of one running level: its simulation clock, function
+# scheduler, controls bus, actor registry and frame timer, plus the renderer
+# if there is one. Nothing of it is global, so several sessions may run
+# side by side in one process.
+#
+#   sess = Session(settings)
+#   sess.level = PickledLevel('level.tog', sess)
+#   sess.graphics = graphics.Graphics(sess)  # optional
+class Session:
+    level = None
+    graphics = None
+
+    # the random generator of the session is seeded with 'seed' (a random
+    # one if it's None), all randomness of the game should come from it
+    def __init__(self, settings, seed = None):
+        self.settings = settings
+        if seed is None: seed = random.getrandbits(32)
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.clock = utils.SimulationClock()
+        self.scheduler = newScheduler(settings, self.clock)
+        self.controls = Controls(settings.coalesce_mouse_motion)
+        self.actors = registry.ActorRegistry()
+        self.timer = frame_timing.NULL_TIMER
@@ -5,13 +5,58 @@ class Settings:
     time_step = 1.0 / hz
     vel_iters = 10
     pos_iters = 8
+    max_steps_per_frame = 5
+
+    #scheduler
+    scheduler = 'heap' # 'heap' or 'wheel' (see utils.TimerWheelScheduler)
 
     #pygame
     screen_size = (800,600)
+    coalesce_mouse_motion = True # one MOUSE_MOTION event per frame
 
     #graphics
     zoom_factor = 1.1
     fullscreen = True
+    max_fps = 144 # 0 means no limit
+    sprite_cache_pixels = 8 * 1024 * 1024
+    sprite_size_bucket_ratio = 2 ** (1/8.)
+    rotation_cache_pixels = 16 * 1024 * 1024
+    rotation_step = 2 # degrees
+    font_face = 'dejavusansmono'
+    font_size = 70
+    text_cache_entries = 64
+    background_cache_pixels = 8 * 1024 * 1024
+    cull_margin = 10 # world units around the screen that are still drawn
+
+    #instrumentation
+    timing_frames = 600 # frames kept by the frame timer
+    timing_csv = None # file the frame timings are written to on exit
+
+    #snapshots of the level for retry / rewind (see snapshot.py)
+    snapshot_interval = 1. # seconds of simulation between snapshots
+    snapshot_count = 30
+
+    #editor
+    autosave_interval = 60 # seconds, None - no autosave
+    autosave_file = 'autosave.tog'
+
+    #input recording (see replay.py)
+    record_input = None # file the input of the session is recorded to
+    replay_input = None # input log replayed into the session
+
+    #batch runs (see batch.py)
+    batch_timeout = 120 # seconds of wall time per job, None - no limit
+    batch_check_steps = 60 # world steps between checks for NaN positions
+
+    #level solver (see solver.py)
+    solver_move_time = 0.25 # seconds every move of the solver lasts
+    solver_beam_width = 200 # states kept per move, None - breadth-first
+    solver_quantum = 0.5 # world units, states closer than that are merged
+    solver_velocity_quantum = 2. # the same for velocities
 
     #gameplay
     time = 45
+    clash_velocity = 10 # minimal relative velocity of a "POW!" clash
+    effect_capacity = 64 # effects shown at once
+    effect_cell = 4 # "POW!"s are limited to one per cell and interval
+    effect_interval = 0.1
@@ -0,0 +1,66 @@
+# The state of a level between two world steps (see Level.snapshot).
+#
+# The b2World is not copied: the snapshot keeps the actors of the level
+# together with the transforms and velocities of the moving bodies, and the
+# state of everything else that changes while the level is played (the
+# clock, scheduler, tweens, effects, random generator, score). Restoring
+# a snapshot puts the bodies back in place and recreates the ones that were
+# removed since.
+class LevelSnapshot:
+    steps = None # world steps done when the snapshot was taken
+    time = None # time of the simulation clock
+    actors = None # ActorRegistry snapshot
+    bodies = None # [(actor, x, y, angle, vx, vy, angular velocity)]
+    states = None # [(actor, Actor.snapshot())], actors with a state only
+    score = None
+    worldEndsAt = None
+    random = None
+    scheduler = None
+    tweens = None
+    effects = None
+    gravity = None
+
+
+# Snapshots of a level taken every 'interval' world steps, the last
+# 'capacity' of them are kept, plus the one taken before the first step.
+# 'update' should be called before every world step.
+#
+#   retry()  - restores the level as it was before the first step
+#   rewind() - restores the newest snapshot older than the current step;
+#              rewinding again goes further back
+class SnapshotRing:
+    def __init__(self, level, capacity = 30, interval = 60):
+        self.level = level
+        self.capacity = capacity
+        self.interval = max(1, interval)
+        self.start = None
+        self.ring = []
+
+    def update(self):
+        level = self.level
+        if self.start is None:
+            self.start = level.snapshot()
+            return
+        if level.steps % self.interval == 0 and \
+                (not self.ring or self.ring[-1].steps != level.steps):
+            self.ring.append(level.snapshot())
+            if len(self.ring) > self.capacity:
+                del self.ring[0]
+
+    def retry(self):
+        if self.start is None: return
+        self.level.restore(self.start)
+        del self.ring[:]
+
+    def rewind(self):
+        steps = self.level.steps
+        while self.ring and self.ring[-1].steps >= steps:
+            self.ring.pop()
+        if self.ring:
+            self.level.restore(self.ring[-1])
+        else:
+            self.retry()
+
+    def clear(self):
+        self.start = None
+        del self.ring[:]
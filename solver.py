@@ -0,0 +1,446 @@
+"""
+Checks whether a level can be solved (all candies brought to the hut)
+within Settings.time, by searching through sequences of moves:
+
+    python solver.py level.tog -j 4 --script-out solution.txt
+
+A move lasts Settings.solver_move_time seconds. It is a gravity change, a
+gorilla move held for the whole move, grabbing or dropping a candy, or
+waiting. The search is a beam search that keeps the Settings.solver_beam_width
+most promising states after every move, or a breadth-first search when the
+width is None (--bfs). States with the same quantized positions and
+velocities of the moving bodies (Settings.solver_quantum,
+solver_velocity_quantum), world angle and the angle it turns to, held candy
+and score are merged.
+
+States are expanded by worker processes. Every worker has its own copy of
+the level and forks the states from its in-memory snapshots (see
+Level.snapshot). A state whose snapshot the worker doesn't have is replayed
+from the start of the level. Snapshots don't carry Box2D's contact cache,
+so every solution found is played again from the start without snapshots
+(like headless.py does); it's reported only if all candies get delivered,
+otherwise the search goes on.
+
+The states merged are only similar, not equal, so a search that finds no
+solution doesn't prove the level can't be solved.
+"""
+import math
+import json
+import time
+import argparse
+import multiprocessing
+import traceback
+from collections import OrderedDict
+import vecmath
+import session
+import headless
+import replay
+import objects
+from controls import TOGEvent, CTRL
+from levels import PickledLevel
+
+# move -> (events dispatched when it starts, events dispatched when it ends)
+MOVES = OrderedDict([
+    ('wait', ((), ())),
+    ('left', (((CTRL.ARROW_LEFT, True),), ((CTRL.ARROW_LEFT, False),))),
+    ('right', (((CTRL.ARROW_RIGHT, True),), ((CTRL.ARROW_RIGHT, False),))),
+    ('up', (((CTRL.ARROW_UP, True),), ((CTRL.ARROW_UP, False),))),
+    ('down', (((CTRL.ARROW_DOWN, True),), ((CTRL.ARROW_DOWN, False),))),
+    ('gravityLeft', (((CTRL.WORLD_LEFT, True),
+            (CTRL.WORLD_LEFT, False)), ())),
+    ('gravityRight', (((CTRL.WORLD_RIGHT, True),
+            (CTRL.WORLD_RIGHT, False)), ())),
+    # GravityDown turns the world the other way round, to the same angle
+    ('gravityUp', (((CTRL.WORLD_UP, True), (CTRL.WORLD_UP, False)), ())),
+    ('grab', (((CTRL.GRAB, True),), ())),
+    ('drop', (((CTRL.GRAB, False),), ())),
+    ])
+
+# value of a delivered candy, more than any distance in a level
+SCORE_VALUE = 1000.
+
+# seconds the expander workers get to stop when the search is over
+CLOSE_TIMEOUT = 5.
+
+class SolverError(Exception): pass
+
+# the input script of a sequence of moves
+def movesLog(moves, moveSteps, seed):
+    records = []
+    for i, move in enumerate(moves):
+        start, end = MOVES[move]
+        for code, pressed in start:
+            records.append((i * moveSteps, code, pressed, None))
+        for code, pressed in end:
+            records.append(((i+1) * moveSteps, code, pressed, None))
+    return replay.InputLog(seed, records)
+
+# plays the moves on a new level, without snapshots, returns True if every
+# candy gets delivered
+def verify(filename, st, seed, moves, moveSteps):
+    sess = session.Session(st, seed)
+    sess.level = PickledLevel(filename, sess)
+    log = movesLog(moves, moveSteps, seed)
+    headless.HeadlessRunner(sess, log, (len(moves) + 1) * moveSteps).run()
+    return not sess.level.candies
+
+
+def finite_(*values):
+    for x in values:
+        if math.isnan(x) or math.isinf(x): return False
+    return True
+
+# A child state of an expansion, 'moves' are the moves from the start of
+# the level
+class Expanded:
+    def __init__(self, moves, status, steps, score, key, value):
+        self.moves = moves
+        self.status = status # 'open', 'solved' or 'lost'
+        self.steps = steps
+        self.score = score
+        self.key = key # None unless it's open
+        self.value = value
+        self.worker = None # the worker that has its snapshot
+
+
+# Plays moves on a level and keeps the snapshots of the states it reached
+# in the last expansion, at most 'cacheSize' of them.
+class Expander:
+    def __init__(self, filename, overrides = None, seed = 0,
+            cacheSize = 1000):
+        st = headless.makeSettings(overrides)
+        # the solver keeps the snapshots it needs itself
+        st.snapshot_interval = st.time + 1
+        self.settings = st
+        self.moveSteps = max(1, int(round(st.solver_move_time * st.hz)))
+        self.cacheSize = cacheSize
+
+        sess = session.Session(st, seed)
+        self.level = level = sess.level = PickledLevel(filename, sess)
+        level.constructWorld()
+        level.createControls()
+        self.controls = sess.controls
+        self.gorilla = level.character
+        self.huts = level.actors.index(objects.GorillaHut)
+        self.root = level.snapshot()
+        self.cache = {}
+
+    # restores the state after 'moves', returns its snapshot
+    def reach_(self, moves):
+        snap = self.cache.get(moves)
+        if snap is not None:
+            self.level.restore(snap)
+            return snap
+        self.level.restore(self.root)
+        for move in moves:
+            self.play_(move)
+        return self.level.snapshot()
+
+    def dispatch_(self, events):
+        for code, pressed in events:
+            self.controls.dispatchEvent_(TOGEvent(code, pressed = pressed))
+
+    # plays a move, stops when the level ends
+    def play_(self, move):
+        start, end = MOVES[move]
+        self.dispatch_(start)
+        for i in xrange(self.moveSteps):
+            if self.status_() != 'open': return
+            self.level.updateWorld()
+        self.dispatch_(end)
+
+    def status_(self):
+        level = self.level
+        if not level.candies: return 'solved'
+        if level.timeLeft() <= 0 or level.diverged(): return 'lost'
+        return 'open'
+
+    def movesNow_(self):
+        if self.gorilla.hasCandy():
+            return [m for m in MOVES if m != 'grab']
+        body = self.gorilla.body
+        res = [m for m in MOVES if m not in ('grab', 'drop')]
+        if self.level.pickClosestCandy(body.position,
+                2*self.gorilla.radius):
+            res.append('grab')
+        return res
+
+    # the quantized state of the level, equal for states the search merges
+    def key_(self):
+        level = self.level
+        st = self.settings
+        q, vq = st.solver_quantum, st.solver_velocity_quantum
+        candy = self.gorilla.candy
+        gravity = level.world_angle
+        # a rotation lasts longer than a move, states rotating towards
+        # different angles must not be merged
+        key = [level.score, candy.id if candy is not None else None,
+                int(gravity.get() % (2*math.pi) // 0.1),
+                int(gravity.goal() % (2*math.pi) // 0.1),
+                gravity.isRotating()]
+        for actor in level.moving.itervalues():
+            body = actor.body
+            if body is None: continue
+            p, v = body.position, body.linearVelocity
+            # int() of NaN or infinity raises
+            if not finite_(p.x, p.y, v.x, v.y): continue
+            key.append((actor.id, int(p.x // q), int(p.y // q),
+                    int(v.x // vq), int(v.y // vq)))
+        return tuple(key)
+
+    # how promising the state is: delivered candies, then how far the
+    # nearest candy is from the gorilla and from a hut
+    def value_(self):
+        level = self.level
+        value = level.score * SCORE_VALUE
+        huts = [hut.body.position for hut in self.huts.itervalues()]
+        if not level.candies or not huts: return value
+
+        def distance(p1, p2):
+            return vecmath.length(p2.x - p1.x, p2.y - p1.y)
+        def toHut(p):
+            return min(distance(p, hut) for hut in huts)
+
+        g = self.gorilla.body.position
+        if self.gorilla.hasCandy():
+            return value - toHut(self.gorilla.candy.body.position)
+        return value - min(distance(g, c.body.position) +
+                toHut(c.body.position) for c in level.candies.itervalues())
+
+    # plays every possible move after each of the given move sequences
+    def expand(self, movesList):
+        res = []
+        cache = {}
+        for moves in movesList:
+            snap = self.reach_(moves)
+            for move in self.movesNow_():
+                self.level.restore(snap)
+                self.play_(move)
+                status = self.status_()
+                child = moves + (move,)
+                # only open states are merged and ranked
+                key = value = None
+                if status == 'open':
+                    key, value = self.key_(), self.value_()
+                res.append(Expanded(child, status, self.level.steps,
+                        self.level.score, key, value))
+                if status == 'open' and len(cache) < self.cacheSize:
+                    cache[child] = self.level.snapshot()
+        self.cache = cache
+        return res
+
+
+# expanders
+
+def worker_(conn, args):
+    try:
+        expander = Expander(*args)
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+        return
+    conn.send(('ready', None))
+    while True:
+        movesList = conn.recv()
+        if movesList is None: break
+        try:
+            conn.send(('ok', expander.expand(movesList)))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+
+# Spreads expansions over 'processes' workers. A state is sent to the
+# worker that has its snapshot, unless that worker got more than its share
+# of the states already.
+class ExpanderPool:
+    def __init__(self, processes, *args):
+        self.conns = []
+        self.processes = []
+        for i in xrange(processes):
+            conn, child = multiprocessing.Pipe()
+            p = multiprocessing.Process(target = worker_, args = (child, args))
+            p.daemon = True
+            p.start()
+            self.conns.append(conn)
+            self.processes.append(p)
+        try:
+            for conn in self.conns:
+                self.receive_(conn)
+        except SolverError:
+            self.close()
+            raise
+
+    def send_(self, conn, msg):
+        try:
+            conn.send(msg)
+        except (IOError, OSError):
+            raise SolverError('an expander worker died')
+
+    def receive_(self, conn):
+        try:
+            status, res = conn.recv()
+        except (EOFError, IOError, OSError):
+            raise SolverError('an expander worker died')
+        if status == 'error': raise SolverError(res)
+        return res
+
+    def expand(self, states):
+        n = len(self.conns)
+        share = (len(states) + n - 1) // n
+        batches = [[] for i in xrange(n)]
+        homeless = []
+        for state in states:
+            if state.worker is not None and len(batches[state.worker]) < share:
+                batches[state.worker].append(state.moves)
+            else:
+                homeless.append(state.moves)
+        for moves in homeless:
+            min(batches, key = len).append(moves)
+
+        for conn, batch in zip(self.conns, batches):
+            self.send_(conn, batch)
+        res = []
+        for i, conn in enumerate(self.conns):
+            for child in self.receive_(conn):
+                child.worker = i
+                res.append(child)
+        return res
+
+    # a worker that is dead already or doesn't stop within CLOSE_TIMEOUT
+    # seconds (e.g. in the middle of an expansion) is terminated
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except (IOError, OSError):
+                pass
+        deadline = time.time() + CLOSE_TIMEOUT
+        for p in self.processes:
+            p.join(max(0., deadline - time.time()))
+            if p.is_alive():
+                p.terminate()
+                p.join()
+        for conn in self.conns:
+            conn.close()
+
+# expands the states in this process
+class LocalExpander:
+    def __init__(self, *args):
+        self.expander = Expander(*args)
+
+    def expand(self, states):
+        res = self.expander.expand([state.moves for state in states])
+        for child in res:
+            child.worker = 0
+        return res
+
+    def close(self): pass
+
+
+# Searches for the shortest (in moves) solution of the level, returns a
+# result dict. 'beamWidth' defaults to Settings.solver_beam_width, 'bfs'
+# makes it a breadth-first search, 'maxStates' limits the number of states
+# expanded.
+def solve(filename, overrides = None, seed = 0, processes = 1,
+        beamWidth = None, bfs = False, maxStates = None):
+    st = headless.makeSettings(overrides)
+    if bfs: beamWidth = None
+    elif beamWidth is None: beamWidth = st.solver_beam_width
+    moveSteps = max(1, int(round(st.solver_move_time * st.hz)))
+
+    started = time.time()
+    args = (filename, overrides, seed)
+    if processes > 1: expanders = ExpanderPool(processes, *args)
+    else: expanders = LocalExpander(*args)
+
+    res = {
+        'level': filename,
+        'seed': seed,
+        'solved': False,
+        'expanded': 0,
+        'merged': 0,
+        'rejected': 0, # solutions that failed the replay from the start
+        }
+    solution = None
+    frontier = [Expanded((), 'open', 0, 0, None, 0.)]
+    seen = set()
+    try:
+        while frontier and solution is None:
+            if maxStates is not None and res['expanded'] >= maxStates:
+                break
+            children = expanders.expand(frontier)
+            res['expanded'] += len(frontier)
+
+            solved = [c for c in children if c.status == 'solved']
+            solved.sort(key = lambda child: child.steps)
+            for child in solved:
+                if verify(filename, st, seed, child.moves, moveSteps):
+                    solution = child
+                    break
+                res['rejected'] += 1
+
+            frontier = []
+            for child in children:
+                if child.status == 'open':
+                    if child.key in seen:
+                        res['merged'] += 1
+                        continue
+                    seen.add(child.key)
+                    frontier.append(child)
+
+            if beamWidth is not None and len(frontier) > beamWidth:
+                frontier.sort(key = lambda child: -child.value)
+                del frontier[beamWidth:]
+    finally:
+        expanders.close()
+
+    res['searchTime'] = time.time() - started
+    if solution is None: return res
+
+    res.update({
+        'solved': True,
+        'moves': list(solution.moves),
+        'steps': solution.steps,
+        'simTime': solution.steps * st.time_step,
+        })
+    res['log'] = movesLog(solution.moves, moveSteps, seed)
+    return res
+
+
+def printResult(res):
+    if res['solved']:
+        print '%s: solved in %.2f s of play (%d moves)' % (res['level'],
+                res['simTime'], len(res['moves']))
+        print '  ' + ' '.join(res['moves'])
+    else:
+        print '%s: no solution found' % res['level']
+    print '%d states expanded, %d merged, %d solutions rejected, %.1f s' % (
+            res['expanded'], res['merged'], res['rejected'],
+            res['searchTime'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description = 'Checks whether a level can be solved in time.')
+    parser.add_argument('level')
+    parser.add_argument('-j', '--processes', type = int,
+            default = multiprocessing.cpu_count())
+    width = parser.add_mutually_exclusive_group()
+    width.add_argument('--beam', type = int, metavar = 'WIDTH',
+            help = 'states kept after every move')
+    width.add_argument('--bfs', action = 'store_true',
+            help = 'breadth-first search, no states are dropped')
+    parser.add_argument('--max-states', type = int)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--set', action = 'append', default = [],
+            metavar = 'NAME=VALUE', help = 'overrides a setting')
+    parser.add_argument('--script-out', metavar = 'FILE',
+            help = 'writes the solution as an input script')
+    parser.add_argument('--json', action = 'store_true',
+            help = 'prints the result as JSON')
+    args = parser.parse_args()
+
+    res = solve(args.level, dict(headless.parseOverride(x) for x in args.set),
+            args.seed, args.processes, args.beam, args.bfs, args.max_states)
+    log = res.pop('log', None)
+    if args.script_out and log is not None:
+        replay.writeScript(args.script_out, log)
+    if args.json: print json.dumps(res, sort_keys = True)
+    else: printResult(res)
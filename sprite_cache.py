@@ -0,0 +1,107 @@
+import math
+import pygame
+import utils
+
+def surfacePixels(surf):
+    w,h = surf.get_size()
+    return w*h
+
+# Keeps decoded sprites and their scaled copies.
+# Every image is loaded from disk only once. Requested sizes are rounded to
+# geometric buckets (ratio settings.sprite_size_bucket_ratio) so that an
+# animated zoom reuses a handful of scaled surfaces instead of producing a
+# new one every frame. Scaled surfaces are evicted in LRU order once their
+# total number of pixels exceeds settings.sprite_cache_pixels.
+class SpriteCache:
+    def __init__(self, settings):
+        self.ratio = settings.sprite_size_bucket_ratio
+        self.log_ratio = math.log(self.ratio)
+        self.sources = {}
+        self.scaled = utils.LRUCache(
+                settings.sprite_cache_pixels, surfacePixels)
+
+    def bucket(self, length):
+        if length <= 1: return 1
+        b = round(math.log(length) / self.log_ratio)
+        return max(1, int(round(self.ratio ** b)))
+
+    def source(self, path):
+        try:
+            return self.sources[path]
+        except KeyError:
+            surf = pygame.image.load(path)
+            if pygame.display.get_surface():
+                surf = surf.convert_alpha()
+            self.sources[path] = surf
+            return surf
+
+    def get(self, path, w, h, flipX=False, flipY=False):
+        key = (path, self.bucket(w), self.bucket(h), flipX, flipY)
+        surf = self.scaled.get(key)
+        if surf is None:
+            surf = pygame.transform.scale(self.source(path), key[1:3])
+            if flipX or flipY:
+                surf = pygame.transform.flip(surf, flipX, flipY)
+            self.scaled.put(key, surf)
+        return surf
+
+    def stats(self):
+        return {
+            'hits': self.scaled.hits,
+            'misses': self.scaled.misses,
+            'evictions': self.scaled.evictions,
+            'entries': len(self.scaled),
+            'pixels': self.scaled.used,
+            'bytes': sum(s.get_width() * s.get_height() * s.get_bytesize()
+                for s in self.scaled.values()),
+            }
+
+
+# Caches rotated copies of the sprites provided by a SpriteCache.
+# Angles (in degrees) are rounded to a multiple of settings.rotation_step, so
+# a sprite spinning with its body produces at most 360/step surfaces.
+class RotationCache:
+    def __init__(self, sprites, settings):
+        self.sprites = sprites
+        self.rotated = utils.LRUCache(
+                settings.rotation_cache_pixels, surfacePixels)
+        self.setStep(settings.rotation_step)
+
+    def setStep(self, step):
+        self.step = step
+        self.positions = max(1, int(round(360. / step)))
+        self.rotated.clear()
+
+    def quantize(self, angle):
+        return int(round(angle / self.step)) % self.positions
+
+    def get(self, path, w, h, angle, flipX=False, flipY=False):
+        q = self.quantize(angle)
+        if q == 0:
+            return self.sprites.get(path, w, h, flipX, flipY)
+
+        bw, bh = self.sprites.bucket(w), self.sprites.bucket(h)
+        key = (path, bw, bh, flipX, flipY, q)
+        surf = self.rotated.get(key)
+        if surf is None:
+            surf = self.sprites.get(path, bw, bh, flipX, flipY)
+            surf = pygame.transform.rotate(surf, q * self.step)
+            self.rotated.put(key, surf)
+        return surf
+
+    # pre-renders the sprite for every given angle (e.g. when a level loads)
+    def warmUp(self, path, w, h, angles, flipX=False, flipY=False):
+        for angle in angles:
+            self.get(path, w, h, angle, flipX, flipY)
+
+    def allAngles(self):
+        return [q * self.step for q in xrange(self.positions)]
+
+    def stats(self):
+        return {
+            'hits': self.rotated.hits,
+            'misses': self.rotated.misses,
+            'evictions': self.rotated.evictions,
+            'entries': len(self.rotated),
+            'pixels': self.rotated.used,
+            }
@@ -0,0 +1,44 @@
+import unittest
+import utils
+
+class FunsctionSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = utils.SimulationClock()
+        self.scheduler = utils.FunsctionScheduler(self.clock)
+
+    def run_(self, steps, dt = 0.1):
+        for i in xrange(steps):
+            self.clock.advance(dt)
+            self.scheduler.work()
+
+    # cancelling many actions inside an action compacts the heap while
+    # 'work' is running, the repeating action must stay scheduled
+    def testCancelDuringWork(self):
+        s = self.scheduler
+        calls = []
+        victims = [s.addAction(lambda: None, delay = 100)
+                for i in xrange(200)]
+
+        def cancelAll():
+            for actionId in victims:
+                s.cancel(actionId)
+            del victims[:]
+        s.addAction(cancelAll, delay = 0.05)
+        s.addAction(lambda: calls.append(1), delay = 0.05,
+                interval = 0.1, callsNo = -1)
+
+        self.run_(10)
+        self.assertEqual(len(calls), 10)
+        self.assertEqual(s.size(), 1)
+
+    def testCancelledActionIsNotPerformed(self):
+        s = self.scheduler
+        calls = []
+        first = s.addAction(lambda: calls.append('first'), delay = 0.05)
+        s.addAction(lambda: s.cancel(first), delay = 0.01)
+        self.run_(1)
+        self.assertEqual(calls, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
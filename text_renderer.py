@@ -0,0 +1,49 @@
+import pygame
+import utils
+
+# Resolves fonts once per (face, size, bold) and keeps rendered strings,
+# so that the HUD does not walk the font database on every frame.
+class TextRenderer:
+    def __init__(self, settings):
+        self.face = settings.font_face
+        self.size = settings.font_size
+        self.fonts = {}
+        self.rendered = utils.LRUCache(settings.text_cache_entries)
+
+    def font(self, face, size, bold):
+        key = (face, size, bold)
+        try:
+            return self.fonts[key]
+        except KeyError:
+            path = pygame.font.match_font(face, bold=bold)
+            font = pygame.font.Font(path, size)
+            self.fonts[key] = font
+            return font
+
+    def render(self, text, color, face=None, size=None, bold=True):
+        key = (text, tuple(color), face or self.face, size or self.size, bold)
+        surf = self.rendered.get(key)
+        if surf is None:
+            surf = self.font(*key[2:]).render(text, 1, color)
+            self.rendered.put(key, surf)
+        return surf
+
+
+# Heads-up display fields: a field is rendered again only when the value
+# it shows has changed
+class Hud:
+    def __init__(self, renderer):
+        self.renderer = renderer
+        self.fields = {} # name -> (value, color, surface)
+
+    def field(self, name, value, color):
+        try:
+            old, oldColor, surf = self.fields[name]
+            if old == value and oldColor == color:
+                return surf
+        except KeyError:
+            pass
+
+        surf = self.renderer.render(str(value), color)
+        self.fields[name] = (value, color, surf)
+        return surf
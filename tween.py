@@ -0,0 +1,241 @@
+import math
+from array import array
+import utils
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# easing curves, map the elapsed part of a tween (0 .. 1) to the part of the
+# change that should be applied
+SINE_OUT = 0
+LINEAR = 1
+QUAD_IN_OUT = 2
+CUBIC_OUT = 3
+
+EASINGS = {
+    SINE_OUT: lambda t: math.sin(math.pi/2 * t),
+    LINEAR: lambda t: t,
+    QUAD_IN_OUT: lambda t: 2*t*t if t < .5 else 1 - 2*(1-t)*(1-t),
+    CUBIC_OUT: lambda t: 1 - (1-t)**3,
+    }
+
+# the same over lists of values, used without NumPy
+LIST_EASINGS = {
+    SINE_OUT: lambda ts: [math.sin(math.pi/2 * t) for t in ts],
+    LINEAR: lambda ts: ts,
+    QUAD_IN_OUT: lambda ts: [2*t*t if t < .5 else 1 - 2*(1-t)*(1-t)
+            for t in ts],
+    CUBIC_OUT: lambda ts: [1 - (1-t)**3 for t in ts],
+    }
+
+if numpy is not None:
+    NUMPY_EASINGS = {
+        SINE_OUT: lambda t: numpy.sin(math.pi/2 * t),
+        LINEAR: lambda t: t,
+        QUAD_IN_OUT: lambda t: numpy.where(t < .5, 2*t*t, 1 - 2*(1-t)*(1-t)),
+        CUBIC_OUT: lambda t: 1 - (1-t)**3,
+        }
+
+
+# A value animated by a TweenEngine
+class Tween:
+    def __init__(self, engine, slot):
+        self.engine = engine
+        self.slot = slot
+
+    def get(self):
+        return self.engine.value[self.slot]
+
+    # the value the tween is heading to, its value when it's not running
+    def goal(self):
+        return self.engine.goal_value[self.slot]
+
+    def isRunning(self):
+        return bool(self.engine.running[self.slot])
+
+    # changes the value by 'delta_value' within 'delta_time' seconds,
+    # starting from the current value (a change in progress is continued
+    # towards its goal moved by delta_value)
+    def init_change(self, delta_value, delta_time = 0.5,
+            easing = SINE_OUT, onDone = None):
+        self.engine.start(self.slot, delta_value, delta_time, easing, onDone)
+
+    # stops the animation and sets the value right away
+    def set(self, value):
+        self.engine.set(self.slot, value)
+
+    def release(self):
+        self.engine.release(self.slot)
+
+
+# Animates many values at once. The state of every tween is kept in packed
+# arrays indexed by the tween's slot and 'step' advances all running tweens
+# in one pass (vectorized if NumPy is available, otherwise over the running
+# tweens only, a group of tweens with the same easing at a time).
+class TweenEngine:
+    FIELDS = {
+        'value': 'd',
+        'start_value': 'd',
+        'goal_value': 'd',
+        'start_time': 'd',
+        'duration': 'd',
+        'easing': 'i',
+        'running': 'b',
+        }
+
+    def __init__(self, clock = utils.WALL_CLOCK, capacity = 16):
+        self.clock = clock
+        self.capacity = 0
+        for name, typecode in self.FIELDS.items():
+            setattr(self, name, self.newArray_(typecode, 0))
+        self.callbacks = {}
+        self.free = []
+        self.active = {} # easing -> set of the running slots
+        self.lastStep = None
+        self.grow_(capacity)
+
+    # copies of the arrays and the bookkeeping of the engine; tweens
+    # created after the snapshot was taken are invalid after restore
+    def snapshot(self):
+        arrays = dict((name, self.copyArray_(getattr(self, name)))
+                for name in self.FIELDS)
+        return (arrays, dict(self.callbacks), self.free[:], self.lastStep,
+                self.capacity)
+
+    def restore(self, (arrays, callbacks, free, lastStep, capacity)):
+        for name, arr in arrays.items():
+            setattr(self, name, self.copyArray_(arr))
+        self.callbacks = dict(callbacks)
+        self.free = free[:]
+        self.lastStep = lastStep
+        self.capacity = capacity
+        self.active = {}
+        for slot in xrange(capacity):
+            if self.running[slot]:
+                self.activate_(slot, int(self.easing[slot]))
+
+    def copyArray_(self, arr):
+        if numpy is not None: return arr.copy()
+        return arr[:]
+
+    def newArray_(self, typecode, size):
+        if numpy is not None:
+            return numpy.zeros(size, {'d': float, 'i': int, 'b': bool}[typecode])
+        return array(typecode, [0]) * size
+
+    def grow_(self, capacity):
+        extra = capacity - self.capacity
+        for name, typecode in self.FIELDS.items():
+            old = getattr(self, name)
+            more = self.newArray_(typecode, extra)
+            if numpy is not None:
+                setattr(self, name, numpy.concatenate((old, more)))
+            else:
+                old.extend(more)
+        self.free.extend(xrange(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def create(self, value):
+        if not self.free:
+            self.grow_(2 * self.capacity)
+        slot = self.free.pop()
+        self.set(slot, value)
+        return Tween(self, slot)
+
+    def activate_(self, slot, easing):
+        self.running[slot] = True
+        self.active.setdefault(easing, set()).add(slot)
+
+    def deactivate_(self, slot):
+        if self.running[slot]:
+            self.running[slot] = False
+            self.active[int(self.easing[slot])].discard(slot)
+
+    def release(self, slot):
+        self.deactivate_(slot)
+        self.callbacks.pop(slot, None)
+        self.free.append(slot)
+
+    def set(self, slot, value):
+        self.deactivate_(slot)
+        self.callbacks.pop(slot, None)
+        self.value[slot] = value
+        self.goal_value[slot] = value
+
+    def start(self, slot, delta_value, delta_time, easing, onDone):
+        self.start_value[slot] = self.value[slot]
+        self.goal_value[slot] += delta_value
+        self.start_time[slot] = self.clock.now()
+        self.duration[slot] = max(delta_time, 1e-9)
+        self.deactivate_(slot)
+        self.easing[slot] = easing
+        self.activate_(slot, easing)
+        if onDone: self.callbacks[slot] = onDone
+        else: self.callbacks.pop(slot, None)
+
+    # advances every running tween to the current time of the clock;
+    # calling it again at the same time does nothing
+    def step(self):
+        now = self.clock.now()
+        if now == self.lastStep: return
+        self.lastStep = now
+
+        if numpy is not None:
+            finished = self.stepNumpy_(now)
+        else:
+            finished = self.stepArrays_(now)
+
+        for slot in finished:
+            callback = self.callbacks.pop(slot, None)
+            if callback: callback()
+
+    def stepNumpy_(self, now):
+        slots = numpy.flatnonzero(self.running)
+        if not len(slots): return ()
+
+        t = (now - self.start_time[slots]) / self.duration[slots]
+        numpy.clip(t, 0., 1., t)
+        eased = t.copy()
+        easing = self.easing[slots]
+        for kind, fun in NUMPY_EASINGS.items():
+            mask = easing == kind
+            if mask.any(): eased[mask] = fun(t[mask])
+
+        start = self.start_value[slots]
+        self.value[slots] = start + (self.goal_value[slots] - start) * eased
+
+        done = slots[t >= 1.]
+        self.value[done] = self.goal_value[done]
+        self.running[done] = False
+        done = done.tolist()
+        for slot in done:
+            self.active[int(self.easing[slot])].discard(slot)
+        return done
+
+    def stepArrays_(self, now):
+        finished = []
+        value, start, goal = self.value, self.start_value, self.goal_value
+        startTime, duration = self.start_time, self.duration
+        for easing, group in self.active.iteritems():
+            if not group: continue
+            slots = list(group)
+            ts = [(now - startTime[slot]) / duration[slot] for slot in slots]
+            done = [slot for slot, t in zip(slots, ts) if t >= 1.]
+            if done:
+                live = [(slot, t) for slot, t in zip(slots, ts) if t < 1.]
+                slots = [slot for slot, t in live]
+                ts = [t for slot, t in live]
+
+            eased = LIST_EASINGS[easing]([max(t, 0.) for t in ts])
+            for slot, e in zip(slots, eased):
+                s = start[slot]
+                value[slot] = s + (goal[slot] - s) * e
+
+            for slot in done:
+                value[slot] = goal[slot]
+                self.running[slot] = False
+                group.discard(slot)
+            finished.extend(done)
+        finished.sort()
+        return finished
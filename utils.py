@@ -1,88 +1,88 @@
 import Box2D as b2d
+import vecmath
 import time
 import math
-import pygame.image
 import heapq
+import itertools
+from collections import OrderedDict
 
-def memoized(fun):
-    mem = {}
-    calc = [0]
-    def g(*args):
+# b2Vec2 (or (x, y)) versions of vecmath.rotate / vecmath.angle_between
+def rotate(vec, angle, center = (0., 0.)):
+    cx, cy = center[0], center[1]
+    x, y = vecmath.rotate(vec[0] - cx, vec[1] - cy, angle)
+    return b2d.b2Vec2(x + cx, y + cy)
+
+def angle_between(vec1, vec2):
+    return vecmath.angle_between(vec1[0], vec1[1], vec2[0], vec2[1])
+
+# Clocks tell the time (in seconds) to schedulers, animations and timers
+class WallClock:
+    def now(self):
+        return time.time()
+
+WALL_CLOCK = WallClock()
+
+# A clock that is advanced explicitly, e.g. by Level.updateWorld one time step
+# at a time. Simulations driven by it can be paused, replayed or run faster
+# than real time.
+class SimulationClock:
+    def __init__(self, start = 0.):
+        self.time = start
+
+    def now(self):
+        return self.time
+
+    def advance(self, dt):
+        self.time += dt
+
+# A least-recently-used cache bounded by the total cost of the stored values
+# ('cost' may return e.g. the number of pixels of a cached surface)
+class LRUCache:
+    def __init__(self, budget, cost = lambda value: 1):
+        self.budget = budget
+        self.cost = cost
+        self.entries = OrderedDict() # key -> (value, cost)
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default = None):
         try:
-            return mem[args]
+            entry = self.entries.pop(key)
         except KeyError:
-            calc[0] += 1
-            print 'calc', calc
-            print args
-            print
-            x = fun(*args)
-            mem[args] = x
-            return x
-    return g
-
-@memoized
-def get_bitmap_(path, w, h, flipX, flipY):
-    surf = pygame.image.load(path)
-    surf = pygame.transform.scale(surf, (w, h))
-    if flipX or flipY:
-        surf = pygame.transform.flip(surf, flipX, flipY)
-    return surf
-
-def get_bitmap(path, w, h, flipX=False, flipY=False):
-    return get_bitmap_(path,w,h,flipX,flipY)
-
-def rotate(vec, angle, center = b2d.b2Vec2(0,0)):
-    res = vec.copy()
-    res -= center
-    res = b2d.b2Mul(b2d.b2Mat22(angle), res)
-    res += center
-    return res
+            self.misses += 1
+            return default
+        self.entries[key] = entry
+        self.hits += 1
+        return entry[0]
 
-def angle_between(vec1, vec2):
-    vec1 = vec1.copy()
-    vec2 = vec2.copy()
-    cos = (vec1.dot(vec2) / vec1.Length() / vec2.Length())
-    if cos<-1: cos = -1.
-    if cos>1: cos = 1.
-    angle = math.acos(cos)
-    if vec1.cross(vec2)<0: return -angle
-    else: return angle
-
-class SmoothChanger:
-    value_ = 0.
-
-    old_value_ = 0.
-    goal_value_ = 0.
-
-    old_time_ = 0.
-    goal_time_ = 0.
-
-    def __init__(self, value):
-        self.value_ = value
-        self.goal_value_ = value
-
-    def init_change(self, delta_value, delta_time = 0.5):
-        self.old_value_ = self.value_
-        self.goal_value_ += delta_value
-
-        self.old_time_ = time.time()
-        self.goal_time_ = self.old_time_ + delta_time
-
-    def step(self):
-        now = time.time()
-        if now > self.goal_time_:
-            self.value_ = self.goal_value_
-            return
+    def put(self, key, value):
+        if key in self.entries:
+            self.used -= self.entries.pop(key)[1]
+
+        cost = self.cost(value)
+        self.entries[key] = (value, cost)
+        self.used += cost
+
+        # the newest entry is kept even if it exceeds the budget on its own
+        while self.used > self.budget and len(self.entries) > 1:
+            _, (_, oldCost) = self.entries.popitem(last = False)
+            self.used -= oldCost
+            self.evictions += 1
 
-        perc = (now - self.old_time_) / (self.goal_time_ - self.old_time_)
-        delta = self.goal_value_ - self.old_value_
-        delta *= math.sin(math.pi/2 * perc)
-        #delta *= perc
-        self.value_ = self.old_value_ + delta
+    def values(self):
+        return [value for value, _ in self.entries.values()]
 
-    def get(self, increment = False):
-       if increment: self.step()
-       return self.value_
+    def clear(self):
+        self.entries.clear()
+        self.used = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
 
 class Enum:
     def __init__(self, *args):
@@ -108,12 +108,13 @@ class PriorityQueue:
 
 
 class RepeatingAction_:
-    next_id = (i for i in xrange(10**9))
+    next_id = itertools.count()
     id = None
     nextTime = None
     interval = None
     callsLeft = None
     fun = None
+    cancelled = False
     def __init__(self, nextTime, interval, callsLeft, fun):
         self.id = self.next_id.next()
         self.nextTime = nextTime
@@ -127,22 +128,53 @@ class RepeatingAction_:
         if self.callsLeft > 0: self.callsLeft -= 1
         self.fun()
 
-    def __le__(self, rh):
-        return self.nextTime < rh.nextTime
+    def cancel(self):
+        self.cancelled = True
+        self.callsLeft = 0
+        self.fun = None
+
+    # actions due at the same time are performed in the order of creation
+    def key(self):
+        return (self.nextTime, self.id)
+
+    def __lt__(self, rh):
+        return self.key() < rh.key()
+
+    # performs every call that is due before 'now'; returns True if the
+    # action should be scheduled again
+    def catchUp(self, now):
+        while self.callsLeft != 0 and self.nextTime < now:
+            self.performOnce()
+        return self.callsLeft != 0
+
+
+def reviveAction_(action, nextTime, callsLeft, fun):
+    action.nextTime = nextTime
+    action.callsLeft = callsLeft
+    action.fun = fun
+    action.cancelled = False
 
 
 # A lazy function scheduler
 # (one has to call 'work' in order to perform every scheduled job)
+#
+# Pending actions are kept in a heap of (nextTime, id, action) entries and in
+# an id -> action map. Cancelling only marks the action; marked entries are
+# skipped when they reach the top of the heap and the heap is rebuilt
+# without them once they make up most of it.
 class FunsctionScheduler:
-    def __init__(self):
-        self.actions = PriorityQueue()
+    def __init__(self, clock = WALL_CLOCK):
+        self.clock = clock
+        self.heap = []
+        self.pending = {}
 
     def addRepeatingAction_(self, action):
-        self.actions.push(action)
+        heapq.heappush(self.heap, (action.nextTime, action.id, action))
+        self.pending[action.id] = action
 
     def addAction(self, fun, delay = 0, interval = 1, callsNo = 1):
         a = RepeatingAction_(
-                nextTime = time.time() + delay,
+                nextTime = self.clock.now() + delay,
                 interval = interval,
                 callsLeft = callsNo,
                 fun = fun)
@@ -151,30 +183,143 @@ class FunsctionScheduler:
 
     def work(self):
         toPerform = []
-        now = time.time()
+        now = self.clock.now()
+
+        heap = self.heap
+        while heap and heap[0][0] < now:
+            action = heapq.heappop(heap)[2]
+            if not action.cancelled:
+                toPerform.append(action)
+
+        for action in toPerform:
+            # an action may be cancelled by one performed before it
+            if action.cancelled: continue
+            # self.heap, not 'heap': an action cancelling others may have
+            # compacted it into a new list
+            if action.catchUp(now) and not action.cancelled:
+                heapq.heappush(self.heap,
+                        (action.nextTime, action.id, action))
+            else:
+                self.pending.pop(action.id, None)
+
+    def cancel(self, actionId):
+        action = self.pending.pop(actionId, None)
+        if action is None:
+            print 'warning, trying to delete non-existing action',actionId
+            return
+
+        action.cancel()
+        if len(self.heap) > 2 * len(self.pending) + 64:
+            self.compact_()
 
-        while (not self.actions.empty()) and self.actions.top().nextTime < now:
-            toPerform.append(self.actions.pop())
+    def compact_(self):
+        self.heap = [e for e in self.heap if not e[2].cancelled]
+        heapq.heapify(self.heap)
 
+    def size(self):
+        return len(self.pending)
+
+    # the pending actions and their progress (see restore)
+    def snapshot(self):
+        return [(a, a.nextTime, a.callsLeft, a.fun)
+                for a in self.pending.itervalues()]
+
+    # brings back the actions that were pending when the snapshot was
+    # taken, the ones added later are cancelled
+    def restore(self, state):
+        for action in self.pending.itervalues():
+            action.cancel()
+        self.heap = []
+        self.pending = {}
+        for action, nextTime, callsLeft, fun in state:
+            reviveAction_(action, nextTime, callsLeft, fun)
+            self.addRepeatingAction_(action)
+
+
+# A scheduler with the interface of FunsctionScheduler, meant for very large
+# numbers of short repeating actions.
+# Time is divided into ticks of 'resolution' seconds and an action is put
+# into the slot of the tick it is due in, so scheduling and cancelling take
+# O(1) and 'work' only visits the slots of the ticks that have passed.
+# Actions are performed up to 'resolution' seconds late.
+class TimerWheelScheduler:
+    def __init__(self, clock = WALL_CLOCK, resolution = 0.01, slots = 512):
+        self.clock = clock
+        self.resolution = resolution
+        self.slots = [[] for _ in xrange(slots)]
+        self.pending = {}
+        self.lastTick = self.tick_(clock.now())
+
+    def tick_(self, t):
+        return int(t / self.resolution)
+
+    def addRepeatingAction_(self, action):
+        tick = max(self.tick_(action.nextTime), self.lastTick + 1)
+        self.slots[tick % len(self.slots)].append((tick, action))
+        self.pending[action.id] = action
+
+    def addAction(self, fun, delay = 0, interval = 1, callsNo = 1):
+        a = RepeatingAction_(
+                nextTime = self.clock.now() + delay,
+                interval = interval,
+                callsLeft = callsNo,
+                fun = fun)
+        self.addRepeatingAction_(a)
+        return a.id
+
+    def work(self):
+        now = self.clock.now()
+        nowTick = self.tick_(now)
+        if nowTick <= self.lastTick: return
+
+        # every slot is visited at most once, even after a long pause
+        first = max(self.lastTick + 1, nowTick - len(self.slots) + 1)
+        toPerform = []
+        for tick in xrange(first, nowTick + 1):
+            index = tick % len(self.slots)
+            slot = self.slots[index]
+            if not slot: continue
+
+            later = []
+            for entry in slot:
+                if entry[1].cancelled: continue
+                if entry[0] <= nowTick: toPerform.append(entry[1])
+                else: later.append(entry)
+            self.slots[index] = later
+        self.lastTick = nowTick
+
+        toPerform.sort()
         for action in toPerform:
-            while action.callsLeft != 0 and action.nextTime < now:
-                action.performOnce()
-            if action.callsLeft != 0:
+            if action.cancelled: continue
+            if action.catchUp(now) and not action.cancelled:
                 self.addRepeatingAction_(action)
+            else:
+                self.pending.pop(action.id, None)
 
-    # this should be optimized if we want to keep a large number of action
-    # inside the scheduler
     def cancel(self, actionId):
-        found = False
-        for action in self.actions.elems:
-            if action.id == actionId:
-                action.fun = lambda: None
-                action.callsLeft = 0
-                found = True
-                break
-
-        if not found:
+        action = self.pending.pop(actionId, None)
+        if action is None:
             print 'warning, trying to delete non-existing action',actionId
+            return
+        action.cancel()
+
+    def size(self):
+        return len(self.pending)
+
+    # see FunsctionScheduler.snapshot
+    def snapshot(self):
+        return (self.lastTick, [(a, a.nextTime, a.callsLeft, a.fun)
+                for a in self.pending.itervalues()])
+
+    def restore(self, (lastTick, actions)):
+        for action in self.pending.itervalues():
+            action.cancel()
+        self.slots = [[] for _ in xrange(len(self.slots))]
+        self.pending = {}
+        self.lastTick = lastTick
+        for action, nextTime, callsLeft, fun in actions:
+            reviveAction_(action, nextTime, callsLeft, fun)
+            self.addRepeatingAction_(action)
 
 
 # A utility class to allow simple job starting and stopping.
@@ -187,23 +332,21 @@ class ContinuousAction:
         self.fun = fun
         self.interval = interval
 
+    # starting a running action or stopping a stopped one does nothing
+    # (a key may be held while a snapshot of the level is restored)
     def start(self):
-        assert not self.actionId
+        if self.actionId is not None: return
         self.actionId = self.repeater.addAction(
                 fun = self.fun, interval = self.interval, callsNo = -1)
 
     def stop(self):
+        if self.actionId is None: return
         self.repeater.cancel(self.actionId)
         self.actionId = None
 
+    # the scheduler's snapshot holds the action itself
+    def snapshot(self):
+        return self.actionId
 
-class Singleton(type):
-    def __init__(cls, *args):
-        super(Singleton, cls).__init__(*args)
-        cls.instance = None
-        print cls, 'init'
-
-    def __call__(cls, *args, **kwargs):
-        if cls.instance is None:
-            cls.instance = super(Singleton, cls).__call__(*args, **kwargs)
-        return cls.instance
+    def restore(self, actionId):
+        self.actionId = actionId
@@ -0,0 +1,59 @@
+import math
+from array import array
+
+# Plain float 2D math for the game code, so that simple vector arithmetic
+# does not go through the Box2D wrapper.
+# Vectors are (x, y) tuples, batches are sequences of tuples or flat
+# array('d', [x0, y0, x1, y1, ...]) buffers.
+
+def length(x, y):
+    return math.hypot(x, y)
+
+def rotate(x, y, angle):
+    c, s = math.cos(angle), math.sin(angle)
+    return (c*x - s*y, s*x + c*y)
+
+# signed angle from vector a to vector b, in (-pi, pi]
+def angle_between(ax, ay, bx, by):
+    cross = ax*by - ay*bx
+    angle = math.atan2(abs(cross), ax*bx + ay*by)
+    if cross < 0: return -angle
+    else: return angle
+
+# the angle wrapped into (-pi, pi]
+def wrap_angle(angle):
+    angle = math.fmod(angle, 2*math.pi)
+    if angle > math.pi: angle -= 2*math.pi
+    elif angle <= -math.pi: angle += 2*math.pi
+    return angle
+
+
+# A rotation with precomputed sin / cos, meant to be created once per frame
+# (or step) and applied to many vectors
+class Rotation:
+    __slots__ = ('angle', 'cos', 'sin')
+
+    def __init__(self, angle):
+        self.angle = angle
+        self.cos = math.cos(angle)
+        self.sin = math.sin(angle)
+
+    def apply(self, x, y):
+        c, s = self.cos, self.sin
+        return (c*x - s*y, s*x + c*y)
+
+    def applyInverse(self, x, y):
+        c, s = self.cos, self.sin
+        return (c*x + s*y, c*y - s*x)
+
+    def applyMany(self, points):
+        c, s = self.cos, self.sin
+        return [(c*x - s*y, s*x + c*y) for x,y in points]
+
+    def applyFlat(self, coords):
+        c, s = self.cos, self.sin
+        xs, ys = coords[0::2], coords[1::2]
+        res = array('d', coords)
+        res[0::2] = array('d', [c*x - s*y for x,y in zip(xs, ys)])
+        res[1::2] = array('d', [s*x + c*y for x,y in zip(xs, ys)])
+        return res